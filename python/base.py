@@ -1,5 +1,13 @@
-import copy
+import codecs
+import collections
+import concurrent.futures
+import difflib
 import fnmatch
+import functools
+import mmap
+import os
+import re
+import tempfile
 from engine import ParserEngine
 
 class ParserBase(ParserEngine):
@@ -9,74 +17,386 @@ class ParserBase(ParserEngine):
     class EmptyMatch(Exception): pass
 
     class Meta:
+        __slots__ = ()
         def setm(self, k, v): setattr(self, k, v); return self
         def getm(self, k): return getattr(self, k)
 
     class Lookup(Meta, dict):
+        __slots__ = ('_index_',)
         @classmethod
         def from_args(cls, *a): return cls(a)
 
     class Sequence(Meta, list):
+        __slots__ = ('_index_', '_parent_', '_span_', '_text_')
         @classmethod
         def from_args(cls, *a): return cls(a)
 
     class Pair(Sequence):
+        __slots__ = ()
         @classmethod
         def from_args(cls, *a): return cls(a)
 
+    # str subclasses cannot have non-empty slots, comments keep their __dict__
     class Comment(Meta, str):
         @classmethod
         def from_str(cls, s): return cls(s) if ('#' in s) else str(s)
 
-    def __init__(self, inp):
-        super().__init__(inp)
+    class Path(collections.namedtuple('Path', ['atrb', 'atrb_i', 'item', 'item_i'])):
+        __slots__ = ()
+
+    class Batch:
+        def __init__(self, parser):
+            self.parser, self.ops, self.results, self.noops = parser, [], [], []
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, et, e, tb):
+            if et is None:
+                self.commit()
+            else:
+                self.ops = []
+            return False
+
+        def put(self, path, value):
+            self.ops.append(('put', path, value))
+            return self
+
+        def drop(self, path, value=None):
+            self.ops.append(('drop', path, value))
+            return self
+
+        def match(self, path, value=None):
+            self.ops.append(('match', path, value))
+            return self
+
+        def commit(self):
+            ops, self.ops = self.ops, []
+            self.results, self.noops = self.parser.batch_proc(ops)
+            return self.results
+
+    class SaveGroup:
+        def __init__(self):
+            self.pending = []
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, et, e, tb):
+            if et is None:
+                self.commit()
+            else:
+                self.abort()
+            return False
+
+        def stage(self, path, data):
+            # a symlink stays in place, the file it points to is replaced
+            path = os.path.realpath(path)
+            dirname, name = os.path.split(path)
+            fd, tmp = tempfile.mkstemp(prefix=f'.{name}.', dir=dirname)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    os.chmod(tmp, 0o644)
+                else:
+                    # ownership is kept where permitted, chown before chmod as it may clear setuid
+                    try:
+                        os.chown(tmp, st.st_uid, st.st_gid)
+                    except PermissionError:
+                        pass
+                    os.chmod(tmp, st.st_mode & 0o7777)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            self.pending.append((tmp, path))
+
+        def commit(self):
+            # all files reach the disk before any of them replaces its target
+            try:
+                for tmp, _ in self.pending:
+                    self.__fsync(tmp)
+            except BaseException:
+                self.abort()
+                raise
+            # a failing replace leaves the targets before it replaced, the rest is discarded
+            replaced = []
+            try:
+                for tmp, path in self.pending:
+                    os.replace(tmp, path)
+                    replaced.append(path)
+            finally:
+                self.pending = self.pending[len(replaced):]
+                self.abort()
+            for d in {os.path.dirname(path) for path in replaced}:
+                self.__fsync(d)
+            return replaced
+
+        def abort(self):
+            for tmp, _ in self.pending:
+                try:
+                    os.unlink(tmp)
+                except FileNotFoundError:
+                    pass
+            self.pending = []
+
+        @staticmethod
+        def __fsync(path):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    CHUNK_SIZE = 65536
+    NON_ASCII = re.compile(rb'[\x80-\xff]')
+
+    def __init__(self, inp, fast=None, **kwargs):
+        # the fast path bypasses the grammar, so it is off when the grammar is instrumented
+        self._fast = not (kwargs.get('packrat') or kwargs.get('profile')) if fast is None else fast
+        super().__init__(inp, **kwargs)
+
+    @classmethod
+    def from_path(cls, path, **kwargs):
+        with open(path, 'rb') as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # empty files cannot be mapped
+                buf = b''
+        # \w cannot be spelled out for bytes, so UTF-8 text outside of ASCII is parsed decoded
+        if cls.NON_ASCII.search(buf) is not None:
+            try:
+                return cls(str(buf, 'utf-8'), **kwargs)
+            except UnicodeDecodeError:
+                pass
+        return cls(buf, **kwargs)
+
+    @classmethod
+    def iter_parse(cls, source, **kwargs):
+        p, buf, offset, line = cls('', **kwargs), '', 0, 0
+        for chunk in cls.__chunks(source):
+            buf += chunk
+            end = cls.split_proc(buf)
+            if end > 0:
+                yield from p.reset(buf[:end], offset, line).parse()
+                offset, line = offset + end, line + buf.count('\n', 0, end)
+                buf = buf[end:]
+        if len(buf) > 0:
+            yield from p.reset(buf, offset, line).parse()
+
+    @classmethod
+    def split_proc(cls, buf):
+        raise NotImplementedError
+
+    @classmethod
+    def _parse_chunk(cls, inp, offset, line, kwargs):
+        return cls('', **kwargs).reset(inp, offset, line).parse()
+
+    @classmethod
+    def grammar(cls):
+        if '_grammar' not in cls.__dict__:
+            cls._grammar = cls.grammar_proc()
+        return cls._grammar
+
+    @classmethod
+    def grammar_proc(cls):
+        raise NotImplementedError
+
+    @staticmethod
+    def spanned(parser):
+        @functools.wraps(parser)
+        def spanned(p):
+            start = p._pos
+            t = parser(p)
+            if isinstance(t, ParserBase.Meta):
+                t.setm('_span_', (p._offset + start, p._offset + p._pos))
+            return t
+        return spanned
+
+    def reset(self, inp, offset=0, line=0):
+        self.parsed = None
+        self._offset, self._line = offset, line
+        self._generation, self._lookup = 0, None
+        self._dirty = {}
+        self._undo, self._pending = None, {}
+        return super().reset(inp)
+
+    def parser_proc(self):
+        return self.grammar()(self)
+
+    def fast_proc(self):
+        return None
 
     def parse(self):
-        self.parsed = self.parser_proc()
-        if len(self._input()) > 0:
-            line = self._inp[0:self._pos].count('\n') + 1
-            text = self._inp[self._pos:(self._pos + 16)].split('\n', 1)[0]
-            raise self.ParseFailure(f"line {line}, at `{text}..'")
+        self.parsed = self.fast_proc() if self._fast else None
+        if self.parsed is None:
+            self.parsed = self.parser_proc()
+            if not self._eof():
+                pos = max(self._pos, self._fail)
+                line, column = self.position(pos)
+                # show the failing line from its start, or the failing statement when the
+                # failure is at the start of a line (a line end left open, or the end of input)
+                start = max(pos - column + 1 if column > 1 else self._pos, pos - 32)
+                text = self._text(start, pos + 16).split('\n', 1)[0]
+                raise self.ParseFailure(f"line {self._line + line}, column {column}, at `{text}..'")
+        self._generation, self._dirty = self._generation + 1, {}
+        return self.parsed
+
+    @property
+    def dirty(self):
+        return list(self._dirty.values())
+
+    def batch(self):
+        return self.Batch(self)
+
+    def batch_proc(self, ops):
+        # operations share one index, patched for the names they change, every mutation is
+        # logged as (node, index, old value) and top-level statements are dropped in one pass
+        self._searchable()
+        dirty, results, noops = dict(self._dirty), [], []
+        self._undo, self._pending = [], {}
+        try:
+            for op in ops:
+                name, path, value = op
+                n = len(self._undo)
+                results.append(getattr(self, name)(path, value))
+                if name != 'match' and all(node[i] == old for node, i, old in self._undo[n:]):
+                    noops.append(op)
+            if self._pending:
+                self._assign(self.parsed, slice(None), [x for x in self.parsed if id(x) not in self._pending])
+        except BaseException:
+            for node, i, old in reversed(self._undo):
+                node[i] = old
+            self._dirty = dirty
+            self._generation += 1
+            raise
+        finally:
+            self._undo, self._pending = None, {}
+        return results, noops
+
+    def parse_parallel(self, workers=None, chunk_size=None):
+        workers = workers or os.cpu_count()
+        # one worker gains nothing from chunks and would pickle every tree back from the pool
+        if workers == 1:
+            return self.parse()
+        # binary input is split as text, surrogateescape keeps the byte offsets exact
+        inp = self._inp if not self._binary else bytes(self._inp).decode('utf-8', 'surrogateescape')
+        chunks = list(self.__split(inp, chunk_size or max(self.CHUNK_SIZE, len(inp) // (workers * 4))))
+        if len(chunks) < 2:
+            return self.parse()
+        kwargs = { 'fast': self._fast, 'packrat': self._packrat }
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            jobs, offset, line = [], self._offset, self._line
+            for chunk in chunks:
+                data = chunk if not self._binary else chunk.encode('utf-8', 'surrogateescape')
+                jobs.append(pool.submit(self._parse_chunk, data, offset, line, kwargs))
+                offset, line = offset + len(data), line + chunk.count('\n')
+            self.parsed = self.Sequence([t for job in jobs for t in job.result()])
+        self._generation, self._dirty = self._generation + 1, {}
         return self.parsed
 
     def render(self, node=None):
+        return ''.join(self.render_iter(node))
+
+    def render_iter(self, node=None):
         raise NotImplementedError
 
+    def render_to(self, fp, node=None):
+        for t in self.render_iter(node):
+            fp.write(t)
+
+    def edits(self):
+        inp, encode = self._inp, (lambda t: t) if not self._binary else (lambda t: t.encode('utf-8'))
+        # a document without statements is replaced as a whole
+        if id(self.parsed) in self._dirty:
+            e = self.__trim(0, inp[:], encode(self.render()))
+            return [e] if e is not None else []
+        live = {id(x) for x in self.parsed}
+        acc, tail = [], []
+        for node in self._dirty.values():
+            span = getattr(node, '_span_', None)
+            if span is None:
+                # new statements are only ever appended
+                if id(node) in live:
+                    tail.append(self.render([node]))
+                continue
+            start, end = span[0] - self._offset, span[1] - self._offset
+            e = self.__trim(start, inp[start:end], encode(self.render([node]) if id(node) in live else ''))
+            if e is not None:
+                acc.append(e)
+        if tail:
+            acc.append((len(inp), 0, encode(''.join(tail))))
+        return sorted(acc, key=lambda e: e[0])
+
+    def patched(self):
+        acc, pos = [], 0
+        for offset, length, text in self.edits():
+            acc.append(self._inp[pos:offset])
+            acc.append(text)
+            pos = offset + length
+        acc.append(self._inp[pos:])
+        return self._inp[:0].join(acc)
+
+    def save(self, path, group=None):
+        data = self.patched()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        # unchanged files keep their mtime, watchers need not reload them
+        if self.__unchanged(path, data):
+            return False
+        g = group if group is not None else self.SaveGroup()
+        g.stage(path, data)
+        if group is None:
+            g.commit()
+        return True
+
+    def diff(self, fromfile='', tofile='', n=3):
+        old, new = self._inp[:], self.patched()
+        if self._binary:
+            old, new = old.decode('utf-8', 'replace'), new.decode('utf-8', 'replace')
+        return ''.join(difflib.unified_diff(old.splitlines(True), new.splitlines(True), fromfile, tofile, n=n))
+
     def match(self, path, value=None):
-        atrb, atrb_i, item, item_i = self._ypath(path, wildcards=True)
-        def recurse(node, pfx, acc):
-            if isinstance(node, self.Pair) and (value is None or node[3] == str(value)):
-                i = node.getm('_index_')
-                idx = '' if i is None else f'[{i}]'
-                acc.append(pfx + idx)
-            elif isinstance(node, self.Sequence):
-                for v in node:
-                    recurse(v, pfx, acc)
-            elif isinstance(node, self.Lookup):
-                if len(pfx) > 0:
-                    i = node.getm('_index_')
-                    idx = '' if i is None else f'[{i}]'
-                    pfx += idx + '/'
-                for k, v in node.items():
-                    recurse(v, pfx + k, acc)
-        found = []
-        recurse(self._filtered(patterns=[atrb, item], indices=[atrb_i, item_i]), '', found)
-        return found
+        return [t[0] for t in self.iter_match(path, value)]
 
     def get(self, path):
+        return [t[1] for t in self.iter_get(path)]
+
+    def iter_match(self, path, value=None):
         atrb, atrb_i, item, item_i = self._ypath(path, wildcards=True)
-        def recurse(node, acc):
-            if isinstance(node, self.Pair):
-                acc.append(node[3])
-            elif isinstance(node, self.Sequence):
-                for v in node:
-                    recurse(v, acc)
+        patterns = [x for x in [atrb, item] if x is not None]
+        indices = [atrb_i, item_i]
+        def recurse(node, p, i, pfx):
+            if isinstance(node, self.Pair) and p == len(patterns):
+                if value is None or node[3] == str(value):
+                    idx = node.getm('_index_')
+                    yield pfx + ('' if idx is None else f'[{idx}]'), node[3], node
             elif isinstance(node, self.Lookup):
-                for v in node.values():
-                    recurse(v, acc)
-        found = []
-        recurse(self._filtered(patterns=[atrb, item], indices=[atrb_i, item_i]), found)
-        return found
+                if p < len(patterns):
+                    if len(pfx) > 0:
+                        idx = node.getm('_index_')
+                        pfx += ('' if idx is None else f'[{idx}]') + '/'
+                    pat = patterns[p]
+                    if self.__literal(pat):
+                        items = [(pat, node[pat])] if pat in node else []
+                    else:
+                        match = self.__glob(pat)
+                        items = ((k, vv) for k, vv in node.items() if match(k))
+                    for k, vv in items:
+                        yield from recurse(vv, p + 1, i, pfx + k)
+            elif isinstance(node, self.Sequence):
+                idx = indices[i] if i < len(indices) else None
+                if idx is None or (idx == 0 and len(node) > 1):
+                    for vv in node:
+                        yield from recurse(vv, p, i + 1, pfx)
+                elif idx != 0 and len(node) > 1 and node[idx - 1] is not None:
+                    yield from recurse(node[idx - 1], p, i + 1, pfx)
+        return recurse(self._searchable(), 0, 0, '')
+
+    def iter_get(self, path):
+        return self.iter_match(path)
 
     def put(self, path, value):
         raise NotImplementedError
@@ -84,50 +404,133 @@ class ParserBase(ParserEngine):
     def drop(self, path, value=None):
         raise NotImplementedError
 
+    @classmethod
+    @functools.lru_cache(maxsize=1024)
+    def compile_path(cls, path):
+        m = cls.PATH.match(path)
+        if m is None:
+            raise cls.InvalidPath
+        g = m.groupdict()
+        return cls.Path(g['atrb'], int(g['atrb_i']) if g['atrb_i'] else None,
+                        g.get('item'), int(g['item_i']) if g.get('item_i') else None)
+
     def _ypath(self, path, wildcards=True):
-        raise NotImplementedError
+        if isinstance(path, list):
+            path = '/'.join(path)
+        if not isinstance(path, self.Path):
+            path = self.compile_path(path)
+        if not wildcards and ('*' in path.atrb or '*' in (path.item or '')):
+            raise self.InvalidPath
+        return path
+
+    @classmethod
+    def __split(cls, inp, size):
+        start, stop = 0, size
+        while start < len(inp):
+            end = cls.split_proc(inp[start:stop]) if stop < len(inp) else len(inp) - start
+            if end == 0:
+                stop += stop - start # no statement boundary yet, widen the window
+                continue
+            yield inp[start:(start + end)]
+            start, stop = start + end, start + end + size
+
+    @classmethod
+    def __chunks(cls, source):
+        def read(f):
+            while True:
+                chunk = f.read(cls.CHUNK_SIZE)
+                if len(chunk) == 0:
+                    return
+                yield chunk
+        if isinstance(source, (str, bytes)):
+            source = [source]
+        elif hasattr(source, 'read'):
+            source = read(source)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in source:
+            yield decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        yield decoder.decode(b'', final=True)
 
     def _searchable(self, node=None):
+        if node is not None:
+            return self.searchable_proc(node)
+        # the index of the whole tree is kept until parse(), put() or drop() bump the generation
+        if self._lookup is None or self._lookup[0] != self._generation:
+            self._lookup = (self._generation, self.searchable_proc(self.parsed))
+        return self._lookup[1]
+
+    def searchable_proc(self, node):
         raise NotImplementedError
 
-    def _filtered(self, node=None, patterns=None, indices=None):
-        def recurse(node, patterns, indices):
-            if isinstance(node, self.Pair) and len(patterns) == 0:
-                return node
-            elif isinstance(node, self.Lookup):
-                try:
-                    pat = patterns.pop(0)
-                except IndexError:
-                    pat = None
-                if pat is not None:
-                    acc = {}
-                    for k, vv in node.items():
-                        if fnmatch.fnmatch(k, pat):
-                            v = recurse(vv, copy.copy(patterns), copy.copy(indices))
-                            if v is not None:
-                                acc[k] = v
-                    if acc:
-                        return self.Lookup(acc).setm('_index_', node.getm('_index_'))
-            elif isinstance(node, self.Sequence):
-                try:
-                    idx = indices.pop(0)
-                except IndexError:
-                    idx = None
-                if idx is None or (idx == 0 and len(node) > 1):
-                    acc = []
-                    for vv in node:
-                        v = recurse(vv, copy.copy(patterns), copy.copy(indices))
-                        if v is not None:
-                            acc.append(v)
-                    acc = [x for x in acc if x is not None]
-                    if acc:
-                        return self.Sequence(acc)
-                elif idx is not None and idx != 0 and len(node) > 1 and node[idx - 1] is not None:
-                    v = recurse(node[idx - 1], copy.copy(patterns), copy.copy(indices))
-                    if v is not None:
-                        return self.Sequence([v])
-        return recurse(
-            self._searchable(node or self.parsed),
-            [x for x in copy.copy(patterns or []) if x is not None],
-            copy.copy(indices or [])
-        )
+    def _assign(self, node, i, value):
+        # returns whether node changed, an equal value is neither logged nor assigned
+        if node[i] == value:
+            return False
+        if self._undo is not None:
+            self._undo.append((node, i, node[i]))
+        node[i] = value
+        return True
+
+    def _append(self, parent, node):
+        if self._undo is not None:
+            self._undo.append((parent, slice(len(parent), None), []))
+        parent.append(node)
+
+    def _remove(self, parent, ids):
+        # top-level statements dropped during a batch are removed when it commits
+        if self._undo is not None and parent is self.parsed:
+            for i in ids:
+                self._undo.append((self._pending, i, None))
+                self._pending[i] = True
+        else:
+            self._assign(parent, slice(None), [x for x in parent if id(x) not in ids])
+
+    def _restructure(self, *names):
+        # outside of a batch the index is rebuilt on next use, within one only the entries of
+        # the changed top-level names are rebuilt, keys stay in order of their first statement
+        if self._undo is None:
+            self._generation += 1
+            return
+        live = [x for x in self.parsed if isinstance(x, self.Sequence) and id(x) not in self._pending]
+        index, sub = self._searchable(), self.searchable_proc([x for x in live if x[1] in names])
+        acc = self.Lookup((k, sub[k] if k in names else index[k]) for k in dict.fromkeys(x[1] for x in live))
+        self._lookup = (self._generation, acc.setm('_index_', None))
+
+    @staticmethod
+    def __unchanged(path, data):
+        try:
+            if os.path.getsize(path) != len(data):
+                return False
+            with open(path, 'rb') as f:
+                return f.read() == data
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def __trim(start, old, new):
+        i, n = 0, min(len(old), len(new))
+        while i < n and old[i] == new[i]:
+            i += 1
+        if i == len(old) == len(new):
+            return None
+        j = 0
+        while j < n - i and old[-1 - j] == new[-1 - j]:
+            j += 1
+        return (start + i, len(old) - i - j, new[i:(len(new) - j)])
+
+    def _touch(self, node):
+        # mark the top-level statement holding node as modified, its cached text is stale
+        while getattr(node, '_parent_', None) is not None and node._parent_ is not self.parsed:
+            node = node._parent_
+        if isinstance(node, self.Sequence):
+            node._text_ = None
+        self._dirty[id(node)] = node
+
+    @staticmethod
+    def __literal(pat):
+        return not ('*' in pat or '?' in pat or '[' in pat)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def __glob(pat):
+        return re.compile(fnmatch.translate(pat)).match
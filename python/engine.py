@@ -1,71 +1,325 @@
+import bisect
+import functools
+import re
+import time
+
 class ParserEngine:
     class ParseFailure(Exception): pass
 
-    def __init__(self, inp):
+    FAIL = object()
+    NEWLINE = re.compile('\n')
+    PACKRAT_SIZE = 4096
+
+    # bytes counterparts of str literals and patterns, used for binary input
+    BINARY_PATTERNS = {}
+
+    # what \s matches in str patterns, spelled out for UTF-8 encoded binary input
+    BINARY_SPACE_ASCII = r'\t-\r\x1c-\x20'
+    BINARY_SPACE_UTF8  = r'\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80'
+
+    def __init__(self, inp, packrat=False, profile=False):
+        self._packrat, self._profiling = packrat, profile
+        self.reset(inp)
+
+    def reset(self, inp):
         self._inp = inp
+        self._binary = not isinstance(inp, str)
         self._pos = 0
+        self._fail = 0
+        self._lines = None
+        self._memo = {} if self._packrat else None
+        self._memo_size = self.PACKRAT_SIZE if self._packrat is True else self._packrat
+        self._memo_stats = { 'hits': 0, 'misses': 0, 'evictions': 0 }
+        self._depth = 0
+        self._profile = {} if self._profiling else None
+        self._scanned = 0
+        return self
+
+    @staticmethod
+    def rule(parser, name=None):
+        key, label = name or parser, name or parser.__name__
+        @functools.wraps(parser)
+        def applied(p):
+            if p._profile is not None:
+                return p.__profiled(label, key, parser)
+            if p._memo is not None:
+                return p.__memoized(key, parser)
+            return parser(p)
+        return applied
+
+    @staticmethod
+    def exact(pattern):
+        return lambda p: p.take_exact(pattern)
+
+    @staticmethod
+    def lookahead(first):
+        def decorate(parser):
+            parser.first = first
+            return parser
+        return decorate
+
+    @staticmethod
+    def choice(*parsers, skip=None):
+        def accepts(parser, c):
+            if isinstance(c, bytes):
+                c = c.decode('latin-1')
+            first = getattr(parser, 'first', None)
+            if first is None:
+                return True
+            if len(c) == 0:
+                return False
+            if isinstance(first, re.Pattern):
+                return first.fullmatch(c) is not None
+            return c in first
+        table = {}
+        def dispatch(p):
+            pos = p._pos if skip is None else p.__skip(skip)
+            c = p._inp[pos:(pos + 1)]
+            alternatives = table.get(c)
+            if alternatives is None:
+                alternatives = table[c] = tuple(x for x in parsers if accepts(x, c))
+            if not alternatives:
+                p._fail = max(p._fail, pos)
+                return p.FAIL
+            return p.one_of(*alternatives)
+        return dispatch
+
+    def packrat_stats(self):
+        hits, misses = self._memo_stats['hits'], self._memo_stats['misses']
+        return dict(self._memo_stats, hit_rate=(hits / (hits + misses) if hits + misses > 0 else 0.0))
+
+    def profile_report(self):
+        return { k: dict(v) for k, v in (self._profile or {}).items() }
 
     def zero_or_more(self, parser):
-        try:
-            matches = []
-            while True:
-                matches.append(self.__backtrack(parser))
-        except self.ParseFailure:
-            return matches
+        FAIL, matches = self.FAIL, []
+        while True:
+            before = self._pos
+            t = parser(self)
+            if t is FAIL:
+                self._pos = before
+                return matches
+            matches.append(t)
+            if self._depth == 0:
+                self.__evict(self._pos)
 
     def one_of(self, *parsers):
+        FAIL, before = self.FAIL, self._pos
+        for parser in parsers:
+            t = parser(self)
+            if t is not FAIL:
+                return t
+            self._pos = before
+        return FAIL
+
+    def seq(self, *parsers):
+        FAIL, before, acc = self.FAIL, self._pos, []
         for parser in parsers:
-            try:
-                return self.__backtrack(parser)
-            except self.ParseFailure:
-                pass
-        self.quit()
+            t = parser(self)
+            if t is FAIL:
+                self._pos = before
+                return FAIL
+            acc.append(t)
+        return acc
+
+    def concat(self, *parsers):
+        t = self.seq(*parsers)
+        return t if t is self.FAIL else ''.join(t)
 
     def between(self, begin, end, inner):
-        def block():
-            begin(); t = inner(); end()
-            return t
-        return self.__backtrack(block)
+        t = self.seq(begin, inner, end)
+        return t if t is self.FAIL else t[1]
 
     def peek(self, length=1):
-        s = self._input()[0:length]
-        return s if len(s) == length else self.quit()
+        if self._binary:
+            length = self.__bytes(length)
+        if isinstance(length, re.Pattern):
+            m = length.match(self._inp, self._pos)
+            return self.quit() if m is None else self.__text(m.group())
+        s = self._inp[self._pos:(self._pos + length)]
+        return self.__text(s) if len(s) == length else self.quit()
 
     def take(self, length=1):
-        t = self.peek(length); self.__consume(length)
+        # a pattern advances by the length of its match
+        if isinstance(length, re.Pattern):
+            return self.take_exact(length)
+        t = self.peek(length)
+        if t is not self.FAIL:
+            self.__consume(length)
         return t
 
     def take_exact(self, pattern):
-        def block():
-            s = self.take(len(pattern))
-            return s if s == pattern else self.quit()
-        return self.__backtrack(block)
+        if self._binary:
+            return self.__take_exact_binary(pattern)
+        if isinstance(pattern, re.Pattern):
+            m = pattern.match(self._inp, self._pos)
+            if m is None:
+                return self.quit()
+            self._pos = m.end()
+            return m.group()
+        if not self._inp.startswith(pattern, self._pos):
+            return self.quit()
+        self.__consume(len(pattern))
+        return pattern
 
     def take_while(self, pred):
-        try:
-            s = ''
-            def block():
-                c = self.take()
-                return c if pred(c) else self.quit()
-            while True:
-                s += self.__backtrack(block)
-            return s
-        except self.ParseFailure:
-            return s
+        if self._binary:
+            return self.__take_while_binary(pred)
+        if isinstance(pred, re.Pattern):
+            m = pred.match(self._inp, self._pos)
+            if m is None:
+                return ''
+            self._pos = m.end()
+            return m.group()
+        start = self._pos
+        while self._pos < len(self._inp) and pred(self._inp[self._pos]):
+            self.__consume()
+        return self._inp[start:self._pos]
 
     def quit(self):
-        raise self.ParseFailure
+        if self._pos > self._fail:
+            self._fail = self._pos
+        return self.FAIL
 
-    def _input(self):
-        return self._inp[self._pos:]
+    def _eof(self):
+        return self._pos >= len(self._inp)
+
+    def _text(self, start, end):
+        return self.__text(self._inp[start:end])
+
+    def position(self, pos):
+        if self._lines is None:
+            newline = self.__bytes(self.NEWLINE) if self._binary else self.NEWLINE
+            self._lines = [m.start() for m in newline.finditer(self._inp)]
+        line = bisect.bisect_left(self._lines, pos)
+        return line + 1, pos - (self._lines[line - 1] + 1 if line > 0 else 0) + 1
+
+    def __skip(self, pattern):
+        if self._binary:
+            pattern = self.__bytes(pattern)
+        return pattern.match(self._inp, self._pos).end()
+
+    def __text(self, s):
+        return s if not self._binary else bytes(s).decode('utf-8', 'replace')
+
+    def __bytes(self, pattern):
+        t = self.BINARY_PATTERNS.get(pattern)
+        if t is None:
+            if isinstance(pattern, re.Pattern):
+                t = re.compile(self.__binary_space(pattern.pattern).encode(), pattern.flags & ~re.UNICODE)
+            elif isinstance(pattern, str):
+                t = pattern.encode()
+            else:
+                return pattern
+            self.BINARY_PATTERNS[pattern] = t
+        return t
+
+    @classmethod
+    def __binary_space(cls, pattern):
+        # \s in bytes patterns is ASCII only, rewrite it so that binary input is split on
+        # the same whitespace as str input
+        acc, i = [], 0
+        while i < len(pattern):
+            if pattern[i] == '\\':
+                t = pattern[i:(i + 2)]
+                acc.append(t if t != r'\s' else f'(?:[{cls.BINARY_SPACE_ASCII}]|{cls.BINARY_SPACE_UTF8})')
+                i += 2
+            elif pattern[i] == '[':
+                negate = pattern[(i + 1):(i + 2)] == '^'
+                j, tokens = i + 1 + negate, []
+                # a leading `]' is a literal
+                while pattern[j] != ']' or not tokens:
+                    tokens.append(pattern[j:(j + 2)] if pattern[j] == '\\' else pattern[j])
+                    j += len(tokens[-1])
+                if r'\s' not in tokens:
+                    acc.append(pattern[i:(j + 1)])
+                else:
+                    body = ''.join(t if t != r'\s' else cls.BINARY_SPACE_ASCII for t in tokens)
+                    if negate:
+                        acc.append(f'(?:(?!{cls.BINARY_SPACE_UTF8})[^{body}])')
+                    else:
+                        acc.append(f'(?:[{body}]|{cls.BINARY_SPACE_UTF8})')
+                i = j + 1
+            else:
+                acc.append(pattern[i])
+                i += 1
+        return ''.join(acc)
+
+    def __take_exact_binary(self, pattern):
+        t = self.__bytes(pattern)
+        if isinstance(t, re.Pattern):
+            m = t.match(self._inp, self._pos)
+            if m is None:
+                return self.quit()
+            self._pos = m.end()
+            return self.__text(m.group())
+        if self._inp[self._pos:(self._pos + len(t))] != t:
+            return self.quit()
+        self.__consume(len(t))
+        return pattern
+
+    def __take_while_binary(self, pred):
+        t = self.__bytes(pred)
+        if isinstance(t, re.Pattern):
+            m = t.match(self._inp, self._pos)
+            if m is None:
+                return ''
+            self._pos = m.end()
+            return self.__text(m.group())
+        # predicates see single bytes (as latin-1 characters) in binary mode
+        start = self._pos
+        while self._pos < len(self._inp) and pred(chr(self._inp[self._pos])):
+            self.__consume()
+        return self.__text(self._inp[start:self._pos])
 
     def __consume(self, length=1):
         self._pos += length
 
-    def __backtrack(self, parser):
-        try:
-            before = self._pos
-            return parser()
-        except self.ParseFailure as e:
-            self._pos = before
-            raise e
+    def __memoized(self, key, parser):
+        pos = self._pos
+        entries = self._memo.get(pos)
+        if entries is None:
+            if len(self._memo) >= self._memo_size:
+                self._memo.pop(next(iter(self._memo)))
+                self._memo_stats['evictions'] += 1
+            entries = self._memo[pos] = {}
+        elif key in entries:
+            self._memo_stats['hits'] += 1
+            t, self._pos = entries[key]
+            return t
+        self._memo_stats['misses'] += 1
+        self._depth += 1
+        t = parser(self)
+        self._depth -= 1
+        if t is self.FAIL:
+            self._pos = pos
+        entries[key] = (t, self._pos)
+        return t
+
+    def __profiled(self, label, key, parser):
+        stats = self._profile.get(label)
+        if stats is None:
+            stats = self._profile[label] = { 'calls': 0, 'successes': 0, 'failures': 0,
+                                             'consumed': 0, 'rescanned': 0, 'time': 0.0 }
+        start, scanned, misses = self._pos, self._scanned, self._memo_stats['misses']
+        clock = time.perf_counter()
+        t = parser(self) if self._memo is None else self.__memoized(key, parser)
+        stats['time'] += time.perf_counter() - clock
+        stats['calls'] += 1
+        if t is self.FAIL:
+            stats['failures'] += 1
+            return t
+        stats['successes'] += 1
+        stats['consumed'] += self._pos - start
+        # input consumed again after an earlier successful attempt was backtracked over,
+        # packrat hits are not counted since they do not scan anything
+        if self._memo is None or self._memo_stats['misses'] > misses:
+            stats['rescanned'] += max(0, min(self._pos, scanned) - start)
+        self._scanned = max(scanned, self._pos)
+        return t
+
+    def __evict(self, pos):
+        if self._memo:
+            kept = { k: v for k, v in self._memo.items() if k >= pos }
+            self._memo_stats['evictions'] += len(self._memo) - len(kept)
+            self._memo = kept
@@ -0,0 +1,11 @@
+import itertools
+import re
+
+class Lexer:
+    def __init__(self, *patterns):
+        # characters not covered by the patterns come out as single-character tokens
+        self.regex = re.compile('|'.join(patterns + (r'[\s\S]',)))
+
+    def tokens(self, inp):
+        toks = self.regex.findall(inp)
+        return toks, list(itertools.accumulate(map(len, toks), initial=0))
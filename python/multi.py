@@ -0,0 +1,54 @@
+import concurrent.futures
+import fnmatch
+import os
+from one import OneParser
+from rc import RcParser
+from yaml import YamlParser
+
+PARSERS = { 'one': OneParser, 'rc': RcParser, 'yaml': YamlParser }
+
+# the first matching basename pattern decides the parser
+PATTERNS = [
+    ('*.conf', OneParser),
+    ('*.rc',   RcParser),
+    ('*.yaml', YamlParser),
+    ('*.yml',  YamlParser),
+]
+
+EXECUTORS = {
+    'process': concurrent.futures.ProcessPoolExecutor,
+    'thread':  concurrent.futures.ThreadPoolExecutor,
+}
+
+def detect(path):
+    name = os.path.basename(path)
+    for pattern, cls in PATTERNS:
+        if fnmatch.fnmatch(name, pattern):
+            return cls
+    raise ValueError(f"no parser for `{path}'")
+
+def parse_many(paths, kind=None, executor='process', workers=None, chunk_size=1, **kwargs):
+    # a bad kind fails on the call, not once per path in the workers
+    cls = PARSERS.get(kind, kind) if isinstance(kind, str) else kind
+    if cls is not None and not isinstance(cls, type):
+        raise ValueError(f"unknown parser `{kind}'")
+    return _parse_many(list(paths), cls, executor, workers, chunk_size, kwargs)
+
+def _parse_many(paths, cls, executor, workers, chunk_size, kwargs):
+    with EXECUTORS[executor](workers) as pool:
+        jobs = [pool.submit(_parse_paths, paths[i:(i + chunk_size)], cls, kwargs)
+                for i in range(0, len(paths), chunk_size)]
+        for job in concurrent.futures.as_completed(jobs):
+            yield from job.result()
+
+def _parse_paths(paths, cls, kwargs):
+    acc = []
+    for path in paths:
+        try:
+            with open(path, encoding='utf-8') as f:
+                p = (cls or detect(path))(f.read(), **kwargs)
+            p.parse()
+            acc.append((path, p))
+        except Exception as e:
+            acc.append((path, e))
+    return acc
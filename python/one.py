@@ -1,136 +1,330 @@
 import copy
 import re
+import sys
 from base import ParserBase
+from lexer import Lexer
 
 class OneParser(ParserBase):
-    class Vector(ParserBase.Sequence): pass
-
-    def parser_proc(self):
-        def quoted():
-            escaped = [False]
-            def pred(c):
-                if c == '\\' or (c == '"' and escaped[0]):
-                    escaped[0] = not escaped[0]
-                    return True
-                else:
-                    return c != '"'
-            return self.between(lambda: self.take_exact('"'),
-                                lambda: self.take_exact('"'),
-                                lambda: '"' + self.take_while(pred) + '"')
-
-        def unquoted():
-            def pred(c):
-                return not (c in [']', '[', '"', ',', '#'] or c.isspace())
-            return self.take_while(pred) if pred(self.peek()) else self.quit()
-
-        def attribute():
-            return self.take_while(lambda c: c == '_' or c.isalnum())
-
-        def blank():
-            return self.take_while(lambda c: c in [' ', '\t'])
-
-        def eol():
-            return self.take_exact('\n')
-
-        def blank_eol():
-            return blank() + eol()
-
-        def comment():
-            return self.Comment.from_str(
-                blank() + self.take_exact('#')
-                        + self.take_while(lambda c: c != '\n')
-                        + eol()
-            )
-
-        def pair():
-            return self.Pair.from_args(
-                blank(),
-                attribute(),
-                blank() + self.take_exact('=') + blank(),
-                self.one_of(quoted,
-                            unquoted),
-                self.one_of(comment,
-                            blank_eol,
-                            blank)
-            )
-
-        def blank_comma():
-            t = blank(); self.take_exact(',')
-            return t
-
-        def item():
-            return self.Pair.from_args(
-                blank(),
-                attribute(),
-                blank() + self.take_exact('=') + blank(),
-                self.one_of(quoted,
-                            unquoted),
-                self.one_of(lambda: self.Comment.from_str(blank_comma() + comment()),
-                            lambda: blank_comma() + blank_eol(),
-                            blank_comma,
-                            comment,
-                            blank_eol,
-                            blank)
-            )
-
-        def vector():
-            return self.Vector.from_args(
-                blank(),
-                attribute(),
-                blank() + self.take_exact('=') + blank(),
-                self.between(lambda: self.take_exact('['),
-                             lambda: self.take_exact(']'),
-                             lambda: self.Sequence.from_args(
-                            *(self.zero_or_more(lambda: self.one_of(item,
-                                                                    comment,
-                                                                    blank_eol)))
-                        )
-                ),
-                self.one_of(comment,
+    class Vector(ParserBase.Sequence):
+        __slots__ = ()
+
+    QUOTED    = re.compile(r'"[^"\\]*(?:\\[^"\\]*[\\"][^"\\]*)*"')
+    UNQUOTED  = re.compile(r'[^\]\[",#\s]+')
+    ATTRIBUTE = re.compile(r'\w*')
+    BLANK     = re.compile(r'[ \t]*')
+    BLANK_EOL = re.compile(r'[ \t]*\n')
+    COMMENT   = re.compile(r'[ \t]*#[^\n]*\n')
+    EQUALS    = re.compile(r'[ \t]*=[ \t]*')
+    COMMA     = re.compile(r'[ \t]*,')
+
+    # paths are ATTRIBUTE[i] or ATTRIBUTE[i]/ITEM[i], `*' is allowed where wildcards are
+    PATH = re.compile(r'''(?x)
+        ^
+        (?P<atrb> [A-Za-z0-9_*]+ )
+        (?:
+            \[ (?P<atrb_i> [0-9]* ) \]
+        )?
+        (?:
+            /
+            (?P<item> [A-Za-z0-9_*]+ )
+            (?:
+                \[ (?P<item_i> [0-9]* ) \]
+            )?
+        )?
+        $
+    ''')
+
+    # top-level statements end at newlines outside of quotes, comments and brackets
+    SPLIT = re.compile('|'.join([QUOTED.pattern, r'#[^\n]*', r'[\[\]\n"]']))
+
+    # first characters (after leading blanks) of the dispatched alternatives
+    FIRST_ASSIGN   = re.compile(r'[\w=]')
+    FIRST_UNQUOTED = re.compile(r'[^\]\[",#\s]')
+
+    # tokens are told apart by their first character, unquoted values are runs of adjacent
+    # UNQUOTED and `=' tokens
+    LEXER = Lexer(QUOTED.pattern, r'#[^\n]*', r'[ \t]+', r'[^\]\[",#\s=]+', r'[\n=\[\],]')
+    WORD  = re.compile(r'\w+')
+
+    @classmethod
+    def grammar_proc(cls):
+        FAIL = cls.FAIL
+
+        @cls.lookahead('"')
+        def quoted(p):
+            return p.take_exact(cls.QUOTED)
+
+        @cls.lookahead(cls.FIRST_UNQUOTED)
+        def unquoted(p):
+            return p.take_exact(cls.UNQUOTED)
+
+        def blank(p):
+            return p.take_while(cls.BLANK)
+
+        @cls.rule
+        @cls.lookahead('\n')
+        def blank_eol(p):
+            return p.take_exact(cls.BLANK_EOL)
+
+        @cls.rule
+        @cls.spanned
+        @cls.lookahead('#')
+        def comment(p):
+            t = p.take_exact(cls.COMMENT)
+            return t if t is FAIL else cls.Comment.from_str(t)
+
+        @cls.rule
+        def assign(p):
+            t = (blank(p),
+                 p.take_while(cls.ATTRIBUTE),
+                 p.take_exact(cls.EQUALS))
+            return FAIL if t[2] is FAIL else t
+
+        value = cls.choice(quoted,
+                           unquoted)
+
+        suffix = cls.choice(comment,
                             blank_eol,
-                            blank)
-            )
-
-        return self.Sequence.from_args(
-            *(self.zero_or_more(lambda: self.one_of(pair,
-                                                    vector,
-                                                    comment,
-                                                    blank_eol)))
-        )
-
-    def __init__(self, inp):
-        super().__init__(inp)
-
-    def render(self, node=None):
-        acc = ''
+                            blank, skip=cls.BLANK)
+
+        @cls.rule
+        @cls.spanned
+        @cls.lookahead(cls.FIRST_ASSIGN)
+        def pair(p):
+            t = p.seq(assign, value)
+            return t if t is FAIL else cls.Pair.from_args(*t[0], t[1], suffix(p))
+
+        @cls.lookahead(',')
+        def blank_comma(p):
+            t = p.take_exact(cls.COMMA)
+            return t if t is FAIL else t[:-1]
+
+        @cls.spanned
+        @cls.lookahead(',')
+        def comma_comment(p):
+            t = p.concat(blank_comma, comment)
+            return t if t is FAIL else cls.Comment.from_str(t)
+
+        @cls.lookahead(',')
+        def comma_eol(p):
+            return p.concat(blank_comma, blank_eol)
+
+        item_suffix = cls.choice(comma_comment,
+                                 comma_eol,
+                                 blank_comma,
+                                 comment,
+                                 blank_eol,
+                                 blank, skip=cls.BLANK)
+
+        @cls.rule
+        @cls.spanned
+        @cls.lookahead(cls.FIRST_ASSIGN)
+        def item(p):
+            t = p.seq(assign, value)
+            return t if t is FAIL else cls.Pair.from_args(*t[0], t[1], item_suffix(p))
+
+        item_statement = cls.choice(item,
+                                    comment,
+                                    blank_eol, skip=cls.BLANK)
+
+        def items(p):
+            return cls.Sequence.from_args(*p.zero_or_more(item_statement))
+
+        def bracketed(p):
+            return p.between(cls.exact('['),
+                             cls.exact(']'),
+                             items)
+
+        @cls.rule
+        @cls.spanned
+        @cls.lookahead(cls.FIRST_ASSIGN)
+        def vector(p):
+            t = p.seq(assign, bracketed)
+            return t if t is FAIL else cls.Vector.from_args(*t[0], t[1], suffix(p))
+
+        statement = cls.choice(pair,
+                               vector,
+                               comment,
+                               blank_eol, skip=cls.BLANK)
+
+        return lambda p: cls.Sequence.from_args(*p.zero_or_more(statement))
+
+    def __init__(self, inp, **kwargs):
+        super().__init__(inp, **kwargs)
+
+    def fast_proc(self):
+        if self._binary:
+            return None
+        toks, offs = self.LEXER.tokens(self._inp)
+        toks.append('')
+        off, word, intern = self._offset, self.WORD.fullmatch, sys.intern
+        Comment, Pair, Sequence, Vector = self.Comment, self.Pair, self.Sequence, self.Vector
+
+        # helpers return (result, next token) or None wherever the grammar has to decide
+
+        def blank(i):
+            t = toks[i]
+            return (t, i + 1) if t[:1] in (' ', '\t') else ('', i)
+
+        def comment(i, j, head):
+            if toks[j][:1] != '#' or toks[j + 1] != '\n':
+                return None
+            t = Comment(head + toks[j] + '\n')
+            t._span_ = (off + offs[i], off + offs[j + 2])
+            return t, j + 2
+
+        def assign(i):
+            b, j = blank(i)
+            a = ''
+            if word(toks[j]):
+                a, j = toks[j], j + 1
+            e, j = blank(j)
+            if toks[j] != '=':
+                return None
+            f, j = blank(j + 1)
+            return intern(b), intern(a), intern(e + '=' + f), j
+
+        def unquoted(t):
+            c = t[:1]
+            return c == '=' or not (c in '"#\n[], \t' or c.isspace())
+
+        def value(j):
+            t = toks[j]
+            if t[:1] == '"':
+                return (t, j + 1) if len(t) > 1 else None
+            if not unquoted(t):
+                return None
+            acc = [t]
+            j += 1
+            while unquoted(toks[j]):
+                acc.append(toks[j])
+                j += 1
+            return ''.join(acc), j
+
+        def suffix(i, item=False):
+            b, j = blank(i)
+            c = toks[j][:1]
+            if item and c == ',':
+                e, k = blank(j + 1)
+                c = toks[k][:1]
+                if c == '#':
+                    t = comment(i, k, b + e)
+                    if t is not None:
+                        return t
+                elif c == '\n':
+                    return intern(b + e + '\n'), k + 1
+                return intern(b), j + 1
+            if c == '#':
+                t = comment(i, j, b)
+                if t is not None:
+                    return t
+            elif c == '\n':
+                return intern(b + '\n'), j + 1
+            return intern(b), j
+
+        def items(j):
+            acc = []
+            while True:
+                b, k = blank(j)
+                c = toks[k][:1]
+                if c == ']':
+                    return (Sequence(acc), k + 1) if not b else None
+                if c == '#':
+                    t = comment(j, k, b)
+                elif c == '\n':
+                    t = b + '\n', k + 1
+                else:
+                    t = assign(j)
+                    v = t and value(t[3])
+                    if v:
+                        x, k = suffix(v[1], item=True)
+                        t = Pair((*t[:3], v[0], x)), k
+                        t[0]._span_ = (off + offs[j], off + offs[k])
+                    else:
+                        t = None
+                if t is None:
+                    return None
+                acc.append(t[0])
+                j = t[1]
+
+        def statement(i):
+            b, j = blank(i)
+            c = toks[j][:1]
+            if c == '#':
+                return comment(i, j, b)
+            if c == '\n':
+                return b + '\n', j + 1
+            t = assign(i)
+            if t is None:
+                return None
+            if toks[t[3]] == '[':
+                v, node = items(t[3] + 1), Vector
+            else:
+                v, node = value(t[3]), Pair
+            if v is None:
+                return None
+            x, j = suffix(v[1])
+            n = node((*t[:3], v[0], x))
+            n._span_ = (off + offs[i], off + offs[j])
+            return n, j
+
+        acc, i, n = [], 0, len(toks) - 1
+        while i < n:
+            t = statement(i)
+            if t is None:
+                return None
+            acc.append(t[0])
+            i = t[1]
+        return Sequence(acc)
+
+    @classmethod
+    def split_proc(cls, buf):
+        end, depth = 0, 0
+        for m in cls.SPLIT.finditer(buf):
+            t = m.group()
+            if t == '\n':
+                if depth == 0:
+                    end = m.end()
+            elif t == '[':
+                depth += 1
+            elif t == ']':
+                depth -= 1
+            elif t == '"':
+                break # unterminated string, wait for more input
+        return end
+
+    def render_iter(self, node=None):
         for vv in (node or self.parsed):
             if isinstance(vv, str):
-                acc += vv
+                yield vv
+            elif getattr(vv, '_text_', None) is not None:
+                yield vv._text_
             elif isinstance(vv, self.Pair):
-                acc += ''.join(vv)
+                vv._text_ = ''.join(vv)
+                yield vv._text_
             elif isinstance(vv, self.Vector):
-                acc += ''.join(vv[0:3])
-                acc += '['
+                acc = [*vv[0:3], '[']
                 count = 0
                 for v in vv[3]:
                     if isinstance(v, self.Pair):
                         count += 1
                 for v in vv[3]:
                     if isinstance(v, str):
-                        acc += v
+                        acc.append(v)
                     elif isinstance(v, self.Pair):
-                        acc += ''.join(v[0:4])
+                        acc.extend(v[0:4])
                         count = count - 1
                         if count > 0:
-                            acc += ','
-                        acc += v[4]
+                            acc.append(',')
+                        acc.append(v[4])
                     else:
                         raise self.InvalidTree
-                acc += ']'
-                acc += vv[4]
+                acc.append(']')
+                acc.append(vv[4])
+                vv._text_ = ''.join(acc)
+                yield vv._text_
             else:
                 raise self.InvalidTree
-        return acc
 
     def put(self, path, value):
         atrb, atrb_i, item, item_i = self._ypath(path, wildcards=False)
@@ -138,20 +332,24 @@ class OneParser(ParserBase):
 
         # add a new pair directly at the root level
         if (s.get(atrb) is None or (atrb_i is not None and atrb_i == 0)) and item is None:
-            self.parsed.append(self.Pair.from_args(
+            self._append(self.parsed, self.Pair.from_args(
                 '', atrb, ' = ', str(value), '\n'
             ))
+            self._touch(self.parsed[-1])
+            self._restructure(atrb)
             return
 
         # add a new vector with a single pair directly at the root level
         if (s.get(atrb) is None or (atrb_i is not None and atrb_i == 0)) and item is not None:
-            self.parsed.append(self.Vector.from_args(
+            self._append(self.parsed, self.Vector.from_args(
                 '', atrb, ' = ', self.Sequence.from_args(
                     '\n', self.Pair.from_args(
                         ' ', item, ' = ', str(value), ' '
                     )
                 ), '\n'
             ))
+            self._touch(self.parsed[-1])
+            self._restructure(atrb)
             return
 
         # require paths to be unequivocal
@@ -171,7 +369,8 @@ class OneParser(ParserBase):
 
         # update the value (root level)
         if item is None:
-            s[3] = str(value)
+            if self._assign(s, 3, str(value)):
+                self._touch(s)
             return
 
         # add a new pair to an existing vector
@@ -179,11 +378,13 @@ class OneParser(ParserBase):
             parent = s[list(s.keys())[0]][0].getm('_parent_') # get parent from a neighbor pair
             indent = self.__infer_vector_indent(parent)
             # apply suffix correction to the former last pair
-            indent['prev_pair'][4] = indent['prev_suffix']
+            self._assign(indent['prev_pair'], 4, indent['prev_suffix'])
+            self._touch(indent['prev_pair'])
             # append new correctly indented pair
-            parent.append(self.Pair.from_args(
+            self._append(parent, self.Pair.from_args(
                 indent['next_prefix'], item, ' = ', str(value), indent['next_suffix']
             ))
+            self._restructure(atrb)
             return
 
         # require paths to be unequivocal
@@ -201,78 +402,46 @@ class OneParser(ParserBase):
             raise self.InvalidPath
 
         # update the value (vector level)
-        s[3] = str(value)
+        if self._assign(s, 3, str(value)):
+            self._touch(s)
         return
 
     def drop(self, path, value=None):
-        atrb, atrb_i, item, item_i = self._ypath(path, wildcards=True)
-        def recurse(node):
-            if isinstance(node, self.Pair) and (value is None or node[3] == str(value)):
-                parent = node.getm('_parent_')
-                for i, x in enumerate(parent):
-                    if id(x) == id(node):
-                        parent.pop(i)
-                        break
-            elif isinstance(node, self.Sequence):
-                for v in node:
-                    recurse(v)
-            elif isinstance(node, self.Lookup):
-                for v in node.values():
-                    recurse(v)
-        recurse(self._filtered(patterns=[atrb, item], indices=[atrb_i, item_i]))
+        parents, names = {}, set()
+        for _, _, node in self.iter_match(path, value):
+            parent = node.getm('_parent_')
+            parents.setdefault(id(parent), (parent, set()))[1].add(id(node))
+            names.add(node[1] if parent is self.parsed else parent.getm('_parent_')[1])
+            self._touch(node)
+        # rebuild every parent once
+        for parent, dropped in parents.values():
+            self._remove(parent, dropped)
         # remove empty vectors
-        for node in self.parsed:
-            if isinstance(node, self.Vector) and not [v for v in node[3] if isinstance(v, self.Pair)]:
-                for i, x in enumerate(self.parsed):
-                    if id(x) == id(node):
-                        self.parsed.pop(i)
-                        break
-
-    def _ypath(self, path, wildcards=True):
-        if isinstance(path, list):
-            path = '/'.join(path)
-        wild = '*' if wildcards else ''
-        regx = rf'''(?x)
-            ^
-            ( [A-Za-z0-9_{wild}]+ )
-            (?:
-                \[ ( [0-9]* ) \]
-            )?
-            (?:
-                /
-                ( [A-Za-z0-9_{wild}]+ )
-                (?:
-                    \[ ( [0-9]* ) \]
-                )?
-            )?
-            $
-        '''
-        m = re.match(regx, path)
-        if m is None:
-            raise self.InvalidPath
-
-        atrb   = m[1]
-        atrb_i = None if len(m[2] or '') == 0 else int(m[2])
-        item   = m[3]
-        item_i = None if len(m[4] or '') == 0 else int(m[4])
-        if atrb is None or (item is None and item_i is not None) \
-                        or (atrb_i is not None and int(atrb_i) < 0) \
-                        or (item_i is not None and int(item_i) < 0):
-            raise self.InvalidPath
-
-        return atrb, atrb_i, item, item_i
-
-    def _searchable(self, node=None):
-        def recurse1(node):
+        empty = set()
+        for x in self.parsed:
+            if isinstance(x, self.Vector) and id(x) not in self._pending \
+                    and not [v for v in x[3] if isinstance(v, self.Pair)]:
+                empty.add(id(x))
+                names.add(x[1])
+                self._touch(x)
+        if empty:
+            self._remove(self.parsed, empty)
+        if parents or empty:
+            self._restructure(*names)
+
+    def searchable_proc(self, node):
+        # top-level pairs belong to the tree, also when only some statements are indexed
+        def recurse1(node, parent):
             acc = self.Lookup()
             for v in node:
                 if isinstance(v, self.Pair):
                     acc[v[1]] = acc.get(v[1], self.Sequence())
                     acc[v[1]].append(v)
-                    v.setm('_parent_', node)
+                    v.setm('_parent_', parent)
                 elif isinstance(v, self.Vector):
                     acc[v[1]] = acc.get(v[1], self.Sequence())
-                    acc[v[1]].append(recurse1(v[3]))
+                    acc[v[1]].append(recurse1(v[3], v[3]))
+                    v[3].setm('_parent_', v)
             return acc
         def recurse2(node, index):
             if isinstance(node, self.Pair):
@@ -285,7 +454,7 @@ class OneParser(ParserBase):
                 for v in node.values():
                     recurse2(v, None)
             return node
-        return recurse2(recurse1(node or self.parsed), None)
+        return recurse2(recurse1(node, self.parsed), None)
 
     def __infer_vector_indent(self, parent):
         acc = { 'has_eol': False,
@@ -1,83 +1,161 @@
 import re
+import sys
 from base import ParserBase
 
 class RcParser(ParserBase):
-    def parser_proc(self):
-        def single_quoted():
-            return self.between(lambda: self.take_exact("'"),
-                                lambda: self.take_exact("'"),
-                                lambda: "'" + self.take_while(lambda c: c != "'") + "'")
-
-        def double_quoted():
-            escaped = [False]
-            def pred(c):
-                if c == '\\' or (c == '"' and escaped[0]):
-                    escaped[0] = not escaped[0]
-                    return True
-                else:
-                    return c != '"'
-            return self.between(lambda: self.take_exact('"'),
-                                lambda: self.take_exact('"'),
-                                lambda: '"' + self.take_while(pred) + '"')
-
-        def unquoted():
-            def pred(c):
-                return not (c == '#' or c.isspace())
-            return self.take_while(pred) if pred(self.peek()) else self.quit()
-
-        def attribute():
-            return self.take_while(lambda c: c == '_' or c.isalnum())
-
-        def blank():
-            return self.take_while(lambda c: c in [' ', '\t'])
-
-        def eol():
-            return self.take_exact('\n')
-
-        def blank_eol():
-            return blank() + eol()
-
-        def comment():
-            return self.Comment.from_str(
-                blank() + self.take_exact('#')
-                        + self.take_while(lambda c: c != '\n')
-                        + eol()
-            )
-
-        def pair():
-            return self.Pair.from_args(
-                self.one_of(lambda: blank() + self.take_exact('export') + blank(),
-                            blank),
-                attribute(),
-                self.take_exact('='),
-                self.one_of(single_quoted,
-                            double_quoted,
-                            unquoted,
-                            blank),
-                self.one_of(comment,
+    SINGLE_QUOTED = re.compile(r"'[^']*'")
+    DOUBLE_QUOTED = re.compile(r'"[^"\\]*(?:\\[^"\\]*[\\"][^"\\]*)*"')
+    UNQUOTED      = re.compile(r'[^#\s]+')
+    ATTRIBUTE     = re.compile(r'\w*')
+    BLANK         = re.compile(r'[ \t]*')
+    BLANK_EOL     = re.compile(r'[ \t]*\n')
+    COMMENT       = re.compile(r'[ \t]*#[^\n]*\n')
+    EXPORT        = re.compile(r'[ \t]*export[ \t]*')
+
+    # paths are ATTRIBUTE[i], `*' is allowed where wildcards are
+    PATH = re.compile(r'''(?x)
+        ^
+        (?P<atrb> [A-Za-z0-9_*]+ )
+        (?:
+            \[ (?P<atrb_i> [0-9]* ) \]
+        )?
+        $
+    ''')
+
+    # a whole top-level statement, mirrors the grammar below and drives the fast path
+    STATEMENT = re.compile(
+        rf'(?P<prefix>{EXPORT.pattern}|{BLANK.pattern})'
+        rf'(?P<name>{ATTRIBUTE.pattern})='
+        rf'(?:(?P<quoted>{SINGLE_QUOTED.pattern}|{DOUBLE_QUOTED.pattern})|(?P<value>{UNQUOTED.pattern}|{BLANK.pattern}))'
+        rf'(?P<suffix>{COMMENT.pattern}|{BLANK_EOL.pattern}|{BLANK.pattern})'
+        rf'|{COMMENT.pattern}'
+        rf'|{BLANK_EOL.pattern}'
+    )
+
+    # first characters (after leading blanks) of the dispatched alternatives
+    FIRST_ASSIGN   = re.compile(r'[\w=]')
+    FIRST_UNQUOTED = re.compile(r'[^#\s]')
+
+    @classmethod
+    def grammar_proc(cls):
+        FAIL = cls.FAIL
+
+        @cls.lookahead("'")
+        def single_quoted(p):
+            return p.take_exact(cls.SINGLE_QUOTED)
+
+        @cls.lookahead('"')
+        def double_quoted(p):
+            return p.take_exact(cls.DOUBLE_QUOTED)
+
+        @cls.lookahead(cls.FIRST_UNQUOTED)
+        def unquoted(p):
+            return p.take_exact(cls.UNQUOTED)
+
+        def blank(p):
+            return p.take_while(cls.BLANK)
+
+        @cls.rule
+        @cls.lookahead('\n')
+        def blank_eol(p):
+            return p.take_exact(cls.BLANK_EOL)
+
+        @cls.rule
+        @cls.spanned
+        @cls.lookahead('#')
+        def comment(p):
+            t = p.take_exact(cls.COMMENT)
+            return t if t is FAIL else cls.Comment.from_str(t)
+
+        @cls.lookahead('e')
+        def export(p):
+            return p.take_exact(cls.EXPORT)
+
+        prefix = cls.choice(export,
+                            blank, skip=cls.BLANK)
+
+        value = cls.choice(single_quoted,
+                           double_quoted,
+                           unquoted,
+                           blank)
+
+        suffix = cls.choice(comment,
                             blank_eol,
-                            blank)
-            )
-
-        return self.Sequence.from_args(
-            *(self.zero_or_more(lambda: self.one_of(pair,
-                                                    comment,
-                                                    blank_eol)))
-        )
-
-    def __init__(self, inp):
-        super().__init__(inp)
-
-    def render(self, node=None):
-        acc = ''
+                            blank, skip=cls.BLANK)
+
+        @cls.rule
+        @cls.spanned
+        @cls.lookahead(cls.FIRST_ASSIGN)
+        def pair(p):
+            t = (prefix(p),
+                 p.take_while(cls.ATTRIBUTE),
+                 p.take_exact('='))
+            if t[2] is FAIL:
+                return FAIL
+            return cls.Pair.from_args(*t, value(p), suffix(p))
+
+        statement = cls.choice(pair,
+                               comment,
+                               blank_eol, skip=cls.BLANK)
+
+        return lambda p: cls.Sequence.from_args(*p.zero_or_more(statement))
+
+    def __init__(self, inp, **kwargs):
+        super().__init__(inp, **kwargs)
+
+    def fast_proc(self):
+        if self._binary:
+            return None
+        acc, pos, off, intern = [], 0, self._offset, sys.intern
+        Comment, Pair = self.Comment, self.Pair
+        for m in self.STATEMENT.finditer(self._inp):
+            start, end = m.span()
+            if start != pos:
+                return None # let the grammar report the failure
+            pos = end
+            prefix, name, quoted, value, x = m.groups()
+            if name is None:
+                t = m.group()
+                if '#' in t:
+                    t = Comment(t)
+                    t._span_ = (off + start, off + end)
+                acc.append(t)
+                continue
+            if '#' in x:
+                x = Comment(x)
+                x._span_ = (off + m.start(5), off + end)
+            else:
+                x = intern(x)
+            t = Pair((intern(prefix), intern(name), '=', quoted or value, x))
+            t._span_ = (off + start, off + end)
+            acc.append(t)
+        return self.Sequence(acc) if pos == len(self._inp) else None
+
+    @classmethod
+    def split_proc(cls, buf):
+        end, pos = 0, 0
+        while True:
+            m = cls.STATEMENT.match(buf, pos)
+            if m is None:
+                break
+            if m['value'] and m['value'][0] in '\'"':
+                break # unterminated string, wait for more input
+            pos = m.end()
+            if buf[pos - 1] == '\n':
+                end = pos
+        return end
+
+    def render_iter(self, node=None):
         for v in (node or self.parsed):
             if isinstance(v, str):
-                acc += v
+                yield v
+            elif getattr(v, '_text_', None) is not None:
+                yield v._text_
             elif isinstance(v, self.Pair):
-                acc += ''.join(v)
+                v._text_ = ''.join(v)
+                yield v._text_
             else:
                 raise self.InvalidTree
-        return acc
 
     def put(self, path, value):
         atrb, atrb_i, _, _ = self._ypath(path, wildcards=False)
@@ -85,9 +163,11 @@ class RcParser(ParserBase):
 
         # add a new pair directly at the root level
         if s.get(atrb) is None or (atrb_i is not None and atrb_i == 0):
-            self.parsed.append(self.Pair.from_args(
+            self._append(self.parsed, self.Pair.from_args(
                 '', atrb, '=', str(value), '\n'
             ))
+            self._touch(self.parsed[-1])
+            self._restructure(atrb)
             return
 
         # require paths to be unequivocal
@@ -105,49 +185,21 @@ class RcParser(ParserBase):
             raise self.InvalidPath
 
         # update the value (root level)
-        s[3] = str(value)
+        if self._assign(s, 3, str(value)):
+            self._touch(s)
         return
 
     def drop(self, path, value=None):
-        atrb, atrb_i, _, _ = self._ypath(path, wildcards=True)
-        def recurse(node):
-            if isinstance(node, self.Pair) and (value is None or node[3] == str(value)):
-                for i, x in enumerate(self.parsed):
-                    if id(x) == id(node):
-                        self.parsed.pop(i)
-                        break
-            elif isinstance(node, self.Sequence):
-                for v in node:
-                    recurse(v)
-            elif isinstance(node, self.Lookup):
-                for v in node.values():
-                    recurse(v)
-        recurse(self._filtered(patterns=[atrb, None], indices=[atrb_i, None]))
-
-    def _ypath(self, path, wildcards=True):
-        if isinstance(path, list):
-            path = '/'.join(path)
-        wild = '*' if wildcards else ''
-        regx = rf'''(?x)
-            ^
-            ( [A-Za-z0-9_{wild}]+ )
-            (?:
-                \[ ( [0-9]* ) \]
-            )?
-            $
-        '''
-        m = re.match(regx, path)
-        if m is None:
-            raise self.InvalidPath
-
-        atrb   = m[1]
-        atrb_i = None if len(m[2] or '') == 0 else int(m[2])
-        if atrb is None or (atrb_i is not None and int(atrb_i) < 0):
-            raise self.InvalidPath
-
-        return atrb, atrb_i, None, None
-
-    def _searchable(self, node=None):
+        dropped, names = set(), set()
+        for _, _, node in self.iter_match(path, value):
+            dropped.add(id(node))
+            names.add(node[1])
+            self._touch(node)
+        if dropped:
+            self._remove(self.parsed, dropped)
+            self._restructure(*names)
+
+    def searchable_proc(self, node):
         def recurse(node, index):
             if isinstance(node, self.Pair):
                 node.setm('_index_', index)
@@ -159,7 +211,7 @@ class RcParser(ParserBase):
                 for v in node.values():
                     recurse(v, None)
         acc = self.Lookup()
-        for v in (node or self.parsed):
+        for v in node:
             if isinstance(v, self.Pair):
                 acc[v[1]] = acc.get(v[1], self.Sequence())
                 acc[v[1]].append(v)
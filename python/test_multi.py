@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from multi import parse_many
+from one import OneParser
+from rc import RcParser
+from yaml import YamlParser
+
+FILES = {
+    'oned.conf': 'A = 1\nV = [\n  N = "x", # c\n  M = 2\n]\n',
+    'sched.conf': '# sched\nB = "y"\n',
+    'one.rc': 'export A="1" # c\nB=2\n',
+    'vm.yaml': 'a: 1 # c\nb: [1, 2]\n',
+    'vm.yml': 'c:\n- d\n',
+    'broken.conf': 'A = 1\nB C\n',
+    'notes.txt': 'A=1\n',
+}
+
+class TestMulti(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.paths = []
+        for name, inp in FILES.items():
+            self.paths.append(os.path.join(self.tmp.name, name))
+            with open(self.paths[-1], 'w', encoding='utf-8') as f:
+                f.write(inp)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ParseMany(self):
+        for executor in ['process', 'thread']:
+            for chunk_size in [1, 3]:
+                results = dict(parse_many(self.paths, executor=executor, workers=2, chunk_size=chunk_size))
+                self.assertEqual(sorted(results), sorted(self.paths))
+                for path, p in results.items():
+                    name = os.path.basename(path)
+                    if name == 'broken.conf':
+                        self.assertIsInstance(p, OneParser.ParseFailure)
+                        self.assertEqual(str(p), "line 2, column 2, at `B C..'")
+                    elif name == 'notes.txt':
+                        self.assertIsInstance(p, ValueError)
+                    else:
+                        self.assertIsInstance(p, {'conf': OneParser, 'rc': RcParser}.get(name.split('.')[-1], YamlParser))
+                        self.assertEqual(p.render(), FILES[name])
+
+    def test_Kind(self):
+        paths = [p for p in self.paths if p.endswith('notes.txt')]
+        for kind in ['one', RcParser]:
+            (path, p), = parse_many(paths, kind=kind, executor='thread')
+            self.assertEqual(p.render(), FILES['notes.txt'])
+        for kind in ['ini', 1, OneParser('A = 1\n')]:
+            with self.assertRaises(ValueError):
+                parse_many(paths, kind=kind)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,8 @@
+import copy
+import io
+import os
+import re
+import tempfile
 import unittest
 from textwrap import dedent as dd
 from one import OneParser
@@ -172,7 +177,11 @@ LEGACY_AUGEAS_GET_TESTS = [
           PASSWORD = "open\\"nebula"
         ]
     '''),
-    ' NIC      = [ model="virtio" ]   '
+    ' NIC      = [ model="virtio" ]   ',
+    dd('''
+        ENTRY = "a \\"b\\" c" # "d"
+        NIC = [ MODEL = "virtio", FILTER = "\\\\" ]
+    ''')
 ]
 
 MATCH_AND_GET_TESTS = [{
@@ -586,8 +595,66 @@ DROP_TESTS = [{
           D = 2 # ASD
         ]
     ''')
+},{
+    "input": dd('''
+        A = 1
+        V = [ N = 1, M = 2 ]
+        V = [ N = 3 ]
+        W = [ N = 4, X = 5 ]
+    '''),
+    "path": '*/N',
+    "value": None,
+    "drop": dd('''
+        A = 1
+        V = [ M = 2 ]
+        W = [ X = 5 ]
+    ''')
+},{
+    "input": dd('''
+        A = 1
+        V = [ N = 1 ]
+        V = [ N = 3 ]
+        B = 2
+    '''),
+    "path": 'V/N',
+    "value": None,
+    "drop": dd('''
+        A = 1
+        B = 2
+    ''')
+}]
+
+PARSE_FAILURE_TESTS = [{
+    "input": 'A = 1\nB C\n',
+    "line": 2,
+    "column": 2,
+    "text": 'B C'
+},{
+    "input": 'V = [\n  A = 1,\n  B = "x\n',
+    "line": 3,
+    "column": 7,
+    "text": '  B = "x'
+},{
+    "input": 'A = 1 #x',
+    "line": 1,
+    "column": 7,
+    "text": 'A = 1 #x'
+},{
+    "input": 'A = 1\nB = \nC = 2\n',
+    "line": 2,
+    "column": 5,
+    "text": 'B = '
+},{
+    "input": 'V = [ N = 1\n',
+    "line": 2,
+    "column": 1,
+    "text": 'V = [ N = 1'
 }]
 
+LARGE_INPUT = ''.join(
+    f'A{i} = "{i}"\nV{i} = [\n  N = {i}, # {i}\n  M = "{i}"\n]\n' for i in range(5000)
+)
+
 class TestOne(unittest.TestCase):
     def test_AugeasLegacyGet(self):
         for aug in LEGACY_AUGEAS_GET_TESTS:
@@ -595,6 +662,327 @@ class TestOne(unittest.TestCase):
             op.parse()
             self.assertEqual(op.render(), aug)
 
+    def test_ParseFailure(self):
+        for d in PARSE_FAILURE_TESTS:
+            op = OneParser(d['input'])
+            with self.assertRaises(OneParser.ParseFailure) as e:
+                op.parse()
+            self.assertEqual(str(e.exception), f"line {d['line']}, column {d['column']}, at `{d['text']}..'")
+            with self.assertRaises(OneParser.ParseFailure) as e:
+                list(OneParser.iter_parse(io.StringIO('A = 1\n' * 100 + d['input'])))
+            self.assertEqual(str(e.exception), f"line {d['line'] + 100}, column {d['column']}, at `{d['text']}..'")
+
+    def test_LargeInput(self):
+        op = OneParser(LARGE_INPUT)
+        op.parse()
+        self.assertEqual(len(op.parsed), 10000)
+        self.assertEqual(op.render(), LARGE_INPUT)
+
+    def test_IterParse(self):
+        for inp in LEGACY_AUGEAS_GET_TESTS + [LARGE_INPUT]:
+            expected = list(OneParser(inp).parse())
+            for size in ([1, 7] if len(inp) < 4096 else []) + [4096]:
+                chunks = [inp[i:(i + size)] for i in range(0, len(inp), size)]
+                self.assertEqual(list(OneParser.iter_parse(chunks)), expected)
+            self.assertEqual(list(OneParser.iter_parse(io.BytesIO(inp.encode()))), expected)
+
+    def test_Take(self):
+        for inp in ['abc = 1\n', b'abc = 1\n']:
+            op = OneParser(inp)
+            self.assertEqual(op.take(re.compile(r'\w+')), 'abc')
+            self.assertEqual(op.take(2), ' =')
+            self.assertIs(op.take(re.compile(r'\w')), op.FAIL)
+            self.assertEqual(op._pos, 5)
+
+    def test_FromPath(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'input')
+            for inp in LEGACY_AUGEAS_GET_TESTS + [LARGE_INPUT, '', 'NAME = "żółw" # ✓\n', 'é = 1\n']:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(inp)
+                p = OneParser.from_path(path)
+                self.assertEqual(p.parse(), OneParser(inp).parse())
+                self.assertEqual(p.render(), inp)
+            # input that is not UTF-8 is parsed as bytes
+            with open(path, 'wb') as f:
+                f.write(b'A = \xe9\n')
+            p = OneParser.from_path(path)
+            p.parse()
+            self.assertTrue(p._binary)
+            p.put('B', 1)
+            self.assertEqual(p.patched(), b'A = \xe9\nB = 1\n')
+
+    def test_BinaryWhitespace(self):
+        # non-ASCII whitespace splits values the same way in str and bytes input
+        for inp in ['=é\x1c\xa0', 'A = x\u2028y\n', 'A = [ N = a\u3000 ]\n', 'A = ✓\xa0\n']:
+            try:
+                expected = OneParser(inp).parse()
+            except OneParser.ParseFailure:
+                expected = None
+            try:
+                self.assertEqual(OneParser(inp.encode()).parse(), expected)
+            except OneParser.ParseFailure:
+                self.assertIsNone(expected)
+
+    def test_ParseParallel(self):
+        op = OneParser(LARGE_INPUT)
+        self.assertEqual(op.parse_parallel(2, 4096), OneParser(LARGE_INPUT).parse())
+        self.assertEqual(op.parsed[-1].getm('_span_'), OneParser(LARGE_INPUT).parse()[-1].getm('_span_'))
+        self.assertEqual(op.render(), LARGE_INPUT)
+        op = OneParser(LARGE_INPUT, fast=False)
+        self.assertEqual(op.parse_parallel(1, 4096), OneParser(LARGE_INPUT).parse())
+        self.assertEqual(op._pos, len(LARGE_INPUT)) # parsed serially
+        for d in PARSE_FAILURE_TESTS:
+            with self.assertRaises(OneParser.ParseFailure) as e:
+                OneParser('A = 1\n' * 1000 + d['input']).parse_parallel(2, 1024)
+            self.assertEqual(str(e.exception), f"line {d['line'] + 1000}, column {d['column']}, at `{d['text']}..'")
+
+    def test_Spans(self):
+        for inp in LEGACY_AUGEAS_GET_TESTS:
+            op = OneParser(inp)
+            op.parse()
+            for node in op.parsed:
+                if not isinstance(node, OneParser.Meta):
+                    continue
+                start, end = node.getm('_span_')
+                self.assertEqual(inp[start:end], op.render([node]))
+                line, column = op.position(start)
+                self.assertEqual(line, inp.count('\n', 0, start) + 1)
+                self.assertEqual(column, start - (inp.rfind('\n', 0, start) + 1) + 1)
+
+    def test_Reset(self):
+        op = OneParser('')
+        for aug in LEGACY_AUGEAS_GET_TESTS:
+            op.reset(aug).parse()
+            self.assertEqual(op.render(), aug)
+        self.assertIs(OneParser.grammar(), OneParser.grammar())
+
+    def test_FastPath(self):
+        for inp in LEGACY_AUGEAS_GET_TESTS + [LARGE_INPUT]:
+            op = OneParser(inp)
+            self.assertIsNotNone(op.fast_proc())
+            expected = OneParser(inp, fast=False).parse()
+            self.assertEqual(op.parse(), expected)
+            self.assertEqual([n.getm('_span_') for n in op.parsed if isinstance(n, OneParser.Meta)],
+                             [n.getm('_span_') for n in expected if isinstance(n, OneParser.Meta)])
+            self.assertEqual(op.render(), inp)
+
+    def test_Packrat(self):
+        for aug in LEGACY_AUGEAS_GET_TESTS + [LARGE_INPUT]:
+            op = OneParser(aug, packrat=True)
+            self.assertEqual(op.parse(), OneParser(aug).parse())
+            self.assertEqual(op.render(), aug)
+        stats = op.packrat_stats()
+        self.assertGreater(stats['hits'], 0)
+        self.assertGreater(stats['evictions'], 0)
+        self.assertGreater(stats['hit_rate'], 0.0)
+
+    def test_Profile(self):
+        op = OneParser(LARGE_INPUT, profile=True)
+        op.parse()
+        report = op.profile_report()
+        self.assertEqual(report['pair']['successes'], 5000)
+        self.assertEqual(report['pair']['failures'], 5000)
+        self.assertEqual(report['vector']['calls'], 5000)
+        self.assertGreater(report['assign']['rescanned'], 0)
+        self.assertEqual(op.render(), LARGE_INPUT)
+        op = OneParser(LARGE_INPUT, profile=True, packrat=True)
+        op.parse()
+        self.assertEqual(op.profile_report()['assign']['rescanned'], 0)
+
+    def test_CompilePath(self):
+        path = OneParser.compile_path('V1/N')
+        self.assertIs(OneParser.compile_path('V1/N'), path)
+        self.assertEqual(path, ('V1', None, 'N', None))
+        op = OneParser(LARGE_INPUT)
+        op.parse()
+        self.assertEqual(op.match(path), op.match('V1/N'))
+        op.put(path, 'x')
+        self.assertEqual(op.get(path), ['x'])
+        with self.assertRaises(OneParser.InvalidPath):
+            op.put(OneParser.compile_path('V*/N'), 'x')
+        op.drop(path)
+        self.assertEqual(op.get(path), [])
+        with self.assertRaises(OneParser.InvalidPath):
+            OneParser.compile_path('V/N/M')
+
+    def test_IterMatch(self):
+        op = OneParser(LARGE_INPUT)
+        op.parse()
+        path, value, node = next(op.iter_match('V*/N'))
+        self.assertEqual((path, value), ('V0/N', '0'))
+        self.assertIs(node, op.parsed[1][3][1])
+        self.assertEqual([t[0] for t in op.iter_match('V*/M', '"7"')], ['V7/M'])
+        self.assertEqual([t[1] for t in op.iter_get('A1*')], op.get('A1*'))
+        self.assertEqual(list(op.iter_get('Q/*')), [])
+
+    def test_Slots(self):
+        op = OneParser(LARGE_INPUT)
+        op.parse()
+        for node in [op.parsed, op.parsed[0], op.parsed[1], op.parsed[1][3], op._searchable()]:
+            self.assertFalse(hasattr(node, '__dict__'))
+        self.assertIs(op.parsed[0][2], op.parsed[2][2])
+        clone = copy.deepcopy(op.parsed)
+        self.assertEqual(clone, op.parsed)
+        self.assertEqual(clone[1].getm('_span_'), op.parsed[1].getm('_span_'))
+
+    def test_Batch(self):
+        inp = 'A = 1\nA = 2\nB = 3\nV = [ N = 1 ]\n'
+        op = OneParser(inp)
+        op.parse()
+        with op.batch() as b:
+            b.put('B', 3).put('C', 4).drop('Q').drop('A', 1).match('V/*').put('V/N', 1)
+        self.assertEqual(b.results, [None, None, None, None, ['V/N'], None])
+        self.assertEqual(b.noops, [('put', 'B', 3), ('drop', 'Q', None), ('put', 'V/N', 1)])
+        self.assertEqual(op.render(), 'A = 2\nB = 3\nV = [ N = 1 ]\nC = 4\n')
+        op = OneParser(inp)
+        op.parse()
+        with self.assertRaises(OneParser.AmbiguousMatch):
+            op.batch().put('D', 5).drop('V/N').put('A', 9).commit()
+        self.assertEqual(op.render(), inp)
+        self.assertEqual(op.get('V/N'), ['1'])
+        op = OneParser(LARGE_INPUT)
+        op.parse()
+        generation = op._generation
+        with op.batch() as b:
+            b.drop('A1').put('V1/Z', 1).put('A1', 'x').drop('V2/*').put('V2/N', 'y').put('A1[0]', 'z')
+        self.assertEqual(b.noops, [])
+        self.assertEqual(op._generation, generation)
+        expected = OneParser(op.render())
+        expected.parse()
+        self.assertEqual(op.match('*') + op.match('*/*'), expected.match('*') + expected.match('*/*'))
+        b = op.batch()
+        with self.assertRaises(KeyError):
+            with b:
+                b.put('D', 5)
+                raise KeyError
+        self.assertEqual(b.commit(), [])
+        self.assertEqual(op.get('D'), [])
+        op = OneParser('A = 1\nB = 2\n')
+        op.parse()
+        op.put('A', '10')
+        with self.assertRaises(OneParser.InvalidPath):
+            op.batch().put('A/X', 'bad').commit()
+        op.put('A', '11')
+        self.assertEqual(op.edits(), [(5, 0, '1')])
+        self.assertEqual(op.patched(), op.render())
+
+    def test_Dirty(self):
+        op = OneParser(LARGE_INPUT)
+        op.parse()
+        self.assertEqual(op.render(), LARGE_INPUT)
+        self.assertEqual(op.dirty, [])
+        text = op.parsed[3].getm('_text_')
+        op.put('V5/N', 5)
+        op.put('A7', '"7"')
+        self.assertEqual(op.dirty, []) # same values
+        op.put('V5/N', 'x')
+        op.put('V9/Z', 1)
+        op.put('A7', 'y')
+        op.drop('A8')
+        self.assertEqual([(type(x).__name__, x[1]) for x in op.dirty],
+                         [('Vector', 'V5'), ('Vector', 'V9'), ('Pair', 'A7'), ('Pair', 'A8')])
+        self.assertIs(op.parsed[3].getm('_text_'), text)
+        self.assertEqual(op.render(), LARGE_INPUT
+            .replace('  N = 5,', '  N = x,')
+            .replace('  M = "9"\n', '  M = "9",\n  Z = 1\n')
+            .replace('A7 = "7"', 'A7 = y')
+            .replace('A8 = "8"\n', ''))
+        op.reset(LARGE_INPUT).parse()
+        self.assertEqual(op.dirty, [])
+
+    def test_Edits(self):
+        op = OneParser('A = 1\nB = 2 # b\nV = [\n  N = 3 ]\nC = 4\n')
+        op.parse()
+        self.assertEqual(op.edits(), [])
+        self.assertEqual(op.diff(), '')
+        op.put('B', 'xy')
+        op.put('V/M', 5)
+        op.drop('C')
+        op.put('D', 6)
+        self.assertEqual(op.edits(), [(10, 1, 'xy'), (29, 0, ',\n  M = 5'), (32, 6, ''), (38, 0, 'D = 6\n')])
+        self.assertEqual(op.patched(), op.render())
+        self.assertEqual(op.diff('a', 'b').splitlines()[3:],
+                         [' A = 1', '-B = 2 # b', '+B = xy # b', ' V = [', '-  N = 3 ]', '-C = 4',
+                          '+  N = 3,', '+  M = 5 ]', '+D = 6'])
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'x.conf')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('A = x\nB = 2\n')
+            op = OneParser.from_path(path)
+            op.parse()
+            op.put('B', 'ü')
+            self.assertEqual(op.edits(), [(10, 1, 'ü'.encode('utf-8'))])
+            self.assertEqual(op.patched(), 'A = x\nB = ü\n'.encode('utf-8'))
+
+    def test_Save(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'x.conf')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('A = 1\n')
+            os.chmod(path, 0o600)
+            op = OneParser.from_path(path)
+            op.parse()
+            self.assertFalse(op.save(path))
+            op.put('A', 2)
+            self.assertTrue(op.save(path))
+            self.assertFalse(op.save(path))
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(f.read(), 'A = 2\n')
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            with OneParser.SaveGroup() as g:
+                self.assertTrue(op.save(os.path.join(d, 'y.conf'), g))
+                self.assertEqual(len(os.listdir(d)), 2)
+            self.assertEqual(sorted(os.listdir(d)), ['x.conf', 'y.conf'])
+            with self.assertRaises(KeyError):
+                with OneParser.SaveGroup() as g:
+                    op.save(os.path.join(d, 'z.conf'), g)
+                    raise KeyError
+            self.assertEqual(sorted(os.listdir(d)), ['x.conf', 'y.conf'])
+            os.mkdir(os.path.join(d, 'z.conf'))
+            op.put('A', 3)
+            with self.assertRaises(OSError):
+                with OneParser.SaveGroup() as g:
+                    op.save(os.path.join(d, 'y.conf'), g)
+                    op.save(os.path.join(d, 'z.conf'), g)
+            self.assertEqual(sorted(os.listdir(d)), ['x.conf', 'y.conf', 'z.conf'])
+            with open(os.path.join(d, 'y.conf'), encoding='utf-8') as f:
+                self.assertEqual(f.read(), 'A = 3\n')
+            # symlinks are kept, their targets are replaced
+            link = os.path.join(d, 'l.conf')
+            os.symlink('x.conf', link)
+            self.assertTrue(op.save(link))
+            self.assertEqual(os.readlink(link), 'x.conf')
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(f.read(), 'A = 3\n')
+            self.assertEqual(sorted(os.listdir(d)), ['l.conf', 'x.conf', 'y.conf', 'z.conf'])
+            # so are owner and group, where permitted
+            if os.geteuid() == 0:
+                os.chown(path, 1234, 5678)
+                op.put('A', 4)
+                self.assertTrue(op.save(path))
+                self.assertEqual((os.stat(path).st_uid, os.stat(path).st_gid), (1234, 5678))
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+    def test_SearchIndex(self):
+        op = OneParser(LARGE_INPUT)
+        op.parse()
+        index = op._searchable()
+        self.assertIs(op._searchable(), index)
+        op.put('V1/N', 'x')
+        self.assertIs(op._searchable(), index)
+        self.assertEqual(op.get('V1/N'), ['x'])
+        op.put('V1/X', 'y')
+        self.assertIsNot(op._searchable(), index)
+        self.assertEqual(op.get('V1/X'), ['y'])
+        index = op._searchable()
+        op.drop('V1/NOPE')
+        self.assertIs(op._searchable(), index)
+        op.drop('V1/*')
+        self.assertEqual(op.get('V1/*'), [])
+        op.reset('A = 1\n').parse()
+        self.assertEqual(list(op._searchable()), ['A'])
+
     def test_MatchAndGet(self):
         for d in MATCH_AND_GET_TESTS:
             op = OneParser(d['input'])
@@ -602,6 +990,15 @@ class TestOne(unittest.TestCase):
             self.assertEqual(op.match(d['path'], d['value']), d['match'])
             self.assertEqual(op.get(d['path']), d['get'])
 
+    def test_RenderTo(self):
+        for inp in LEGACY_AUGEAS_GET_TESTS + [LARGE_INPUT]:
+            op = OneParser(inp)
+            op.parse()
+            f = io.StringIO()
+            op.render_to(f)
+            self.assertEqual(f.getvalue(), inp)
+            self.assertEqual(''.join(op.render_iter()), inp)
+
     def test_Put(self):
         for d in PUT_TESTS:
             op = OneParser(d['input'])
@@ -1,3 +1,6 @@
+import io
+import os
+import tempfile
 import unittest
 from textwrap import dedent as dd
 from rc import RcParser
@@ -250,6 +253,10 @@ DROP_TESTS = [{
     ''')
 }]
 
+LARGE_INPUT = ''.join(
+    f'export A{i}="{i}" # {i}\nS{i}=\'{i}\'\n\n' for i in range(5000)
+)
+
 class TestRc(unittest.TestCase):
     def test_ParseAndRender(self):
         for inp in PARSE_AND_RENDER_TESTS:
@@ -257,6 +264,201 @@ class TestRc(unittest.TestCase):
             rc.parse()
             self.assertEqual(rc.render(), inp)
 
+    def test_LargeInput(self):
+        rc = RcParser(LARGE_INPUT)
+        rc.parse()
+        self.assertEqual(len(rc.parsed), 15000)
+        self.assertEqual(rc.render(), LARGE_INPUT)
+
+    def test_IterParse(self):
+        for inp in PARSE_AND_RENDER_TESTS + [LARGE_INPUT]:
+            expected = list(RcParser(inp).parse())
+            for size in ([1, 7] if len(inp) < 4096 else []) + [4096]:
+                chunks = [inp[i:(i + size)] for i in range(0, len(inp), size)]
+                self.assertEqual(list(RcParser.iter_parse(chunks)), expected)
+            self.assertEqual(list(RcParser.iter_parse(io.BytesIO(inp.encode()))), expected)
+
+    def test_FromPath(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'input')
+            for inp in PARSE_AND_RENDER_TESTS + [LARGE_INPUT, '', 'Aé=1\n']:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(inp)
+                p = RcParser.from_path(path)
+                self.assertEqual(p.parse(), RcParser(inp).parse())
+                self.assertEqual(p.render(), inp)
+
+    def test_BinaryWhitespace(self):
+        # non-ASCII whitespace splits values the same way in str and bytes input
+        for inp in ['A=é\x1c\xa0', 'A=x\u2028y\n', 'A=a\x85 # c\n', 'A=✓\xa0\n']:
+            try:
+                expected = RcParser(inp).parse()
+            except RcParser.ParseFailure:
+                expected = None
+            try:
+                self.assertEqual(RcParser(inp.encode()).parse(), expected)
+            except RcParser.ParseFailure:
+                self.assertIsNone(expected)
+
+    def test_ParseParallel(self):
+        rc = RcParser(LARGE_INPUT)
+        self.assertEqual(rc.parse_parallel(2, 4096), RcParser(LARGE_INPUT).parse())
+        self.assertEqual(rc.parsed[-2].getm('_span_'), RcParser(LARGE_INPUT).parse()[-2].getm('_span_'))
+        self.assertEqual(rc.render(), LARGE_INPUT)
+
+    def test_Spans(self):
+        for inp in PARSE_AND_RENDER_TESTS:
+            rc = RcParser(inp)
+            rc.parse()
+            for node in rc.parsed:
+                if not isinstance(node, RcParser.Meta):
+                    continue
+                start, end = node.getm('_span_')
+                self.assertEqual(inp[start:end], rc.render([node]))
+                line, column = rc.position(start)
+                self.assertEqual(line, inp.count('\n', 0, start) + 1)
+                self.assertEqual(column, start - (inp.rfind('\n', 0, start) + 1) + 1)
+
+    def test_Reset(self):
+        rc = RcParser('')
+        for inp in PARSE_AND_RENDER_TESTS:
+            rc.reset(inp).parse()
+            self.assertEqual(rc.render(), inp)
+        self.assertIs(RcParser.grammar(), RcParser.grammar())
+
+    def test_FastPath(self):
+        for inp in PARSE_AND_RENDER_TESTS + [LARGE_INPUT]:
+            rc = RcParser(inp)
+            self.assertIsNotNone(rc.fast_proc())
+            expected = RcParser(inp, fast=False).parse()
+            self.assertEqual(rc.parse(), expected)
+            self.assertEqual([n.getm('_span_') for n in rc.parsed if isinstance(n, RcParser.Meta)],
+                             [n.getm('_span_') for n in expected if isinstance(n, RcParser.Meta)])
+            self.assertEqual(rc.render(), inp)
+
+        # statements the regex cannot match are left to the grammar to report
+        inp = "A=it's\nB C\n"
+        self.assertIsNone(RcParser(inp).fast_proc())
+        with self.assertRaises(RcParser.ParseFailure) as e:
+            RcParser(inp).parse()
+        self.assertEqual(str(e.exception), "line 2, column 2, at `B C..'")
+
+    def test_Packrat(self):
+        for inp in PARSE_AND_RENDER_TESTS + [LARGE_INPUT]:
+            rc = RcParser(inp, packrat=16)
+            self.assertEqual(rc.parse(), RcParser(inp).parse())
+            self.assertEqual(rc.render(), inp)
+        self.assertGreater(rc.packrat_stats()['misses'], 0)
+
+    def test_Profile(self):
+        rc = RcParser(LARGE_INPUT, profile=True)
+        rc.parse()
+        report = rc.profile_report()
+        self.assertEqual(report['pair']['successes'], 10000)
+        self.assertEqual(report['blank_eol']['successes'], 10000)
+        self.assertEqual(report['pair']['consumed'], len(LARGE_INPUT) - 5000)
+        self.assertEqual(rc.render(), LARGE_INPUT)
+
+    def test_CompilePath(self):
+        path = RcParser.compile_path('A1')
+        self.assertIs(RcParser.compile_path('A1'), path)
+        self.assertEqual(path, ('A1', None, None, None))
+        rc = RcParser(LARGE_INPUT)
+        rc.parse()
+        rc.put(path, 'x')
+        self.assertEqual(rc.get(path), ['x'])
+        with self.assertRaises(RcParser.InvalidPath):
+            RcParser.compile_path('V/N')
+
+    def test_IterMatch(self):
+        rc = RcParser(LARGE_INPUT)
+        rc.parse()
+        path, value, node = next(rc.iter_match('S*'))
+        self.assertEqual((path, value), ('S0', "'0'"))
+        self.assertIs(node, rc.parsed[1])
+        self.assertEqual([t[1] for t in rc.iter_get('A1*')], rc.get('A1*'))
+
+    def test_Batch(self):
+        inp = 'A=1\nA=2\nB=3\n'
+        rc = RcParser(inp)
+        rc.parse()
+        with rc.batch() as b:
+            b.put('B', 3).put('C', 4).drop('A', 1)
+        self.assertEqual(b.noops, [('put', 'B', 3)])
+        self.assertEqual(rc.render(), 'A=2\nB=3\nC=4\n')
+        rc = RcParser(inp)
+        rc.parse()
+        with self.assertRaises(RcParser.AmbiguousMatch):
+            with rc.batch() as b:
+                b.drop('B').put('A', 9)
+        self.assertEqual(rc.render(), inp)
+        generation = rc._generation
+        with rc.batch() as b:
+            b.drop('A', 1).put('A', 7).put('C', 8).drop('B').put('B', 9)
+        self.assertEqual(b.noops, [])
+        self.assertEqual(rc._generation, generation)
+        self.assertEqual(rc.render(), 'A=7\nC=8\nB=9\n')
+        self.assertEqual(rc.match('*'), ['A', 'C', 'B'])
+        rc = RcParser(inp)
+        rc.parse()
+        rc.put('B', 4)
+        with self.assertRaises(RcParser.AmbiguousMatch):
+            rc.batch().put('A', 9).commit()
+        rc.put('B', 5)
+        self.assertEqual(rc.patched(), rc.render())
+
+    def test_Dirty(self):
+        rc = RcParser(LARGE_INPUT)
+        rc.parse()
+        self.assertEqual(rc.render(), LARGE_INPUT)
+        rc.put('S1', "'1'")
+        self.assertEqual(rc.dirty, []) # same value
+        rc.put('S1', 'x')
+        rc.put('X', 'y')
+        rc.drop('A2')
+        self.assertEqual([x[1] for x in rc.dirty], ['S1', 'X', 'A2'])
+        self.assertEqual(rc.render(), LARGE_INPUT
+            .replace("S1='1'", 'S1=x')
+            .replace('export A2="2" # 2\n', '') + 'X=y\n')
+
+    def test_Edits(self):
+        rc = RcParser(LARGE_INPUT)
+        rc.parse()
+        rc.put('S1', 'x')
+        rc.put('X', 'y')
+        rc.drop('A2')
+        self.assertEqual(len(rc.edits()), 3)
+        self.assertEqual(rc.patched(), rc.render())
+        self.assertIn('+X=y\n', rc.diff())
+
+    def test_Save(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'x.rc')
+            rc = RcParser(LARGE_INPUT)
+            rc.parse()
+            self.assertTrue(rc.save(path))
+            self.assertFalse(rc.save(path))
+            rc.put('X', 'y')
+            self.assertTrue(rc.save(path))
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(f.read(), LARGE_INPUT + 'X=y\n')
+
+    def test_SearchIndex(self):
+        rc = RcParser(LARGE_INPUT)
+        rc.parse()
+        index = rc._searchable()
+        self.assertIs(rc._searchable(), index)
+        rc.put('A1', 'x')
+        self.assertIs(rc._searchable(), index)
+        rc.put('X', 'y')
+        self.assertIsNot(rc._searchable(), index)
+        self.assertEqual(rc.get('X'), ['y'])
+        index = rc._searchable()
+        rc.drop('NOPE')
+        self.assertIs(rc._searchable(), index)
+        rc.drop('A1')
+        self.assertEqual(rc.get('A1'), [])
+
     def test_MatchAndGet(self):
         for d in MATCH_AND_GET_TESTS:
             rc = RcParser(d['input'])
@@ -264,6 +466,15 @@ class TestRc(unittest.TestCase):
             self.assertEqual(rc.match(d['path'], d['value']), d['match'])
             self.assertEqual(rc.get(d['path']), d['get'])
 
+    def test_RenderTo(self):
+        for inp in PARSE_AND_RENDER_TESTS + [LARGE_INPUT]:
+            rc = RcParser(inp)
+            rc.parse()
+            f = io.StringIO()
+            rc.render_to(f)
+            self.assertEqual(f.getvalue(), inp)
+            self.assertEqual(''.join(rc.render_iter()), inp)
+
     def test_Put(self):
         for d in PUT_TESTS:
             rc = RcParser(d['input'])
@@ -1,3 +1,6 @@
+import io
+import os
+import tempfile
 import unittest
 from textwrap import dedent
 from yaml import YamlParser
@@ -227,12 +230,81 @@ class TestYaml(unittest.TestCase):
             yp.parse()
             self.assertEqual(yp.render(), inp)
 
+    def test_FromPath(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'input')
+            for inp in PARSE_AND_RENDER_TESTS:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(inp)
+                yp = YamlParser.from_path(path)
+                yp.parse()
+                self.assertEqual(yp.render(), inp)
+
     def test_Get(self):
         for d in GET_TESTS:
             yp = YamlParser(d['input'])
             yp.parse()
             self.assertEqual(yp.get(d['path']), d['get'])
 
+    def test_Batch(self):
+        inp = 'a: 1\nb:\n- 2\n'
+        yp = YamlParser(inp)
+        yp.parse()
+        with yp.batch() as b:
+            b.put(['a'], 1).put(['c'], 3).drop(['b', 1])
+        self.assertEqual(b.noops, [('put', ['a'], 1)])
+        self.assertEqual(yp.render(), 'a: 1\nb: []\nc: 3\n')
+        yp = YamlParser(inp)
+        yp.parse()
+        with self.assertRaises(YamlParser.EmptyMatch):
+            yp.batch().put(['c'], 3).put(['d', 1], 4).commit()
+        self.assertEqual(yp.render(), inp)
+
+    def test_RenderTo(self):
+        for inp in PARSE_AND_RENDER_TESTS:
+            yp = YamlParser(inp)
+            yp.parse()
+            f = io.StringIO()
+            yp.render_to(f)
+            self.assertEqual(f.getvalue(), inp)
+            self.assertEqual(''.join(yp.render_iter()), inp)
+
+    def test_Dirty(self):
+        yp = YamlParser('a: 1\n')
+        yp.parse()
+        self.assertEqual(yp.dirty, [])
+        with self.assertRaises(YamlParser.EmptyMatch):
+            yp.put(['a', 'x'], 2)
+        with self.assertRaises(YamlParser.InvalidPath):
+            yp.put(['a', None], 2)
+        with self.assertRaises(YamlParser.EmptyMatch):
+            yp.drop(['c'])
+        self.assertEqual(yp.dirty, [])
+        self.assertEqual(yp.edits(), [])
+        yp.put(['b'], 2)
+        self.assertEqual(yp.dirty, [yp.parsed])
+
+    def test_Edits(self):
+        yp = YamlParser('a: 1\nb:\n  c: 2\n')
+        yp.parse()
+        self.assertEqual(yp.edits(), [])
+        yp.put(['b', 'c'], 3)
+        self.assertEqual(yp.edits(), [(13, 1, '3')])
+        self.assertEqual(yp.patched(), 'a: 1\nb:\n  c: 3\n')
+
+    def test_Save(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'x.yaml')
+            yp = YamlParser('a: 1\n')
+            yp.parse()
+            with YamlParser.SaveGroup() as g:
+                self.assertTrue(yp.save(path, g))
+            self.assertFalse(yp.save(path))
+            yp.put(['b'], 2)
+            self.assertTrue(yp.save(path))
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(f.read(), 'a: 1\nb: 2\n')
+
     def test_Put(self):
         for d in PUT_TESTS:
             yp = YamlParser(d['input'])
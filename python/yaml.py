@@ -1,3 +1,4 @@
+import copy
 import io
 from base import ParserBase
 
@@ -5,20 +6,66 @@ class YamlParser(ParserBase):
     def parser_proc(self):
         raise NotImplementedError
 
-    def __init__(self, inp):
-        super().__init__(inp)
+    def __init__(self, inp, **kwargs):
+        super().__init__(inp, **kwargs)
+        self.yaml = self.__yaml()
+
+    # the round-trip loader holds compiled patterns, it is rebuilt instead of pickled
+    def __getstate__(self):
+        return { k: v for k, v in self.__dict__.items() if k != 'yaml' }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.yaml = self.__yaml()
+
+    @staticmethod
+    def __yaml():
         from ruamel.yaml import YAML
-        self.yaml = YAML(typ='rt', pure=True)
-        self.yaml.preserve_quotes = True
+        yaml = YAML(typ='rt', pure=True)
+        yaml.preserve_quotes = True
+        return yaml
+
+    @classmethod
+    def from_path(cls, path, **kwargs):
+        with open(path, encoding='utf-8') as f:
+            return cls(f.read(), **kwargs)
 
     def parse(self):
-        self.parsed = self.yaml.load(self._inp)
+        self.parsed, self._dirty = self.yaml.load(self._inp), {}
         return self.parsed
 
+    def batch_proc(self, ops):
+        # documents have no index to share, operations run in order on a copy of the document,
+        # which replaces it only when all of them succeed
+        parsed, dirty = self.parsed, dict(self._dirty)
+        self.parsed = copy.deepcopy(parsed)
+        if id(parsed) in self._dirty:
+            del self._dirty[id(parsed)]
+            self._touch(self.parsed)
+        results, noops = [], []
+        try:
+            for op in ops:
+                name, path, value = op
+                before = self.get(path) if name != 'match' else None
+                results.append(getattr(self, name)(path, value))
+                if name != 'match' and self.get(path) == before:
+                    noops.append(op)
+        except BaseException:
+            self.parsed, self._dirty = parsed, dirty
+            raise
+        return results, noops
+
     def render(self, node=None):
-        b = io.BytesIO()
-        self.yaml.dump(self.parsed, b)
-        return b.getvalue().decode('utf-8')
+        s = io.StringIO()
+        self.yaml.dump(self.parsed, s)
+        return s.getvalue()
+
+    # ruamel pushes its output, so only render_to() avoids the intermediate string
+    def render_iter(self, node=None):
+        yield self.render(node)
+
+    def render_to(self, fp, node=None):
+        self.yaml.dump(self.parsed, fp)
 
     def match(self, path, value=None):
         raise NotImplementedError
@@ -70,6 +117,7 @@ class YamlParser(ParserBase):
                         v = v[p]
                     else:
                         raise self.InvalidPath
+                    self._touch(self.parsed)
             elif isinstance(p, int):
                 if not isinstance(v, list):
                     raise self.EmptyMatch
@@ -89,6 +137,7 @@ class YamlParser(ParserBase):
                         v = t
                     else:
                         raise self.InvalidPath
+                    self._touch(self.parsed)
                 else:
                     raise self.InvalidPath
             else:
@@ -112,6 +161,7 @@ class YamlParser(ParserBase):
                 raise self.InvalidPath
         else:
             raise self.InvalidPath
+        self._touch(self.parsed) # the document is the only statement
 
     def drop(self, path, value=None):
         if value is not None:
@@ -159,6 +209,7 @@ class YamlParser(ParserBase):
                 raise self.InvalidPath
         else:
             raise self.InvalidPath
+        self._touch(self.parsed)
 
     def _ypath(self, path, wildcards=True):
         if wildcards is not None:
@@ -169,6 +220,3 @@ class YamlParser(ParserBase):
 
     def _searchable(self, node=None):
         raise NotImplementedError
-
-    def _filtered(self, node=None, patterns=None, indices=None):
-        raise NotImplementedError